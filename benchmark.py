@@ -0,0 +1,432 @@
+#benchmark suite for the apparel image generator
+#times the renderers, build_image_from_assets and full batches on the real bin/ assets
+
+import argparse
+import contextlib
+import csv
+import io
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import PIL
+from PIL import Image
+
+import generator
+
+SOURCE_BIN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bin')
+TEAM = "NCAA-OHIO ST BUCKEYES"
+COLOR = "GRAPHITE"
+ART_TYPE = "STACKED BOX NEUTRAL"
+CLASSES = ("CREW", "HOODIE", "LS TEES", "SS TEES")
+SPORTS = ("FOOTBALL", "BASKETBALL", "BASEBALL", "SOFTBALL", "WOMEN'S VOLLEYBALL", "GOLF", "TRACK & FIELD", "WRESTLING")
+SYLLABLES = ("AL", "BEN", "CA", "DEL", "ER", "FI", "GAN", "HO", "IS", "JA", "KO", "LE", "MAR", "NO", "OR", "PA", "RI", "SON", "TY", "VAN", "WIL", "ZA")
+
+# Renderer micro-benchmarks run on the garment blank and coords of this class
+RENDER_CLASS = "CREW"
+
+# RSS and children's ru_maxrss (KiB) when the current case started, see reset_peak_rss
+_case_rss_start = 0
+_children_rss_mark = 0
+
+def _rss_kib(value):
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    return value // 1024 if sys.platform == 'darwin' else value
+
+def _proc_status_kib(field):
+    # A "VmRSS:"-style line of /proc/self/status in KiB, None off Linux
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+def run_peak_rss_mb():
+    # Highest RSS of this process or any pool worker over the whole run
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return round(_rss_kib(max(own, children)) / 1024, 1)
+
+def reset_peak_rss():
+    # Starts a new peak for peak_rss_mb. ru_maxrss only ever grows, so on its
+    # own every case would report the largest case run before it. Linux
+    # resets this process's high-water mark (VmHWM) when 5 is written to
+    # clear_refs. Returns False where that is unavailable.
+    global _case_rss_start, _children_rss_mark
+    _children_rss_mark = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        _case_rss_start = 0
+        return False
+    _case_rss_start = _proc_status_kib('VmRSS') or 0
+    return True
+
+def peak_rss_mb():
+    # (peak RSS since reset_peak_rss, growth over the RSS the case started
+    # with) in MB. The peak includes whatever earlier cases left resident.
+    # Pool workers can't be reset, so they only count when one of them set a
+    # new high during the case.
+    own = _proc_status_kib('VmHWM')
+    if own is None:
+        own = _rss_kib(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    if children > _children_rss_mark:
+        own = max(own, _rss_kib(children))
+    return round(own / 1024, 1), round(max(0, own - _case_rss_start) / 1024, 1)
+
+def git_commit():
+    try:
+        out = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)), check=True)
+        return out.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def random_name(rng, length):
+    name = ""
+    while len(name) < length:
+        name += rng.choice(SYLLABLES)
+    return name[:length].capitalize()
+
+def art_type_for(border_width):
+    return ART_TYPE if border_width == 0 else f"{ART_TYPE} BW{border_width}"
+
+def make_asset_bin(bin_dir, border_widths):
+    # Copies the real asset folders into bin_dir, adding a bordered variant of
+    # the design for every non-zero border width. Blanks and fonts are linked,
+    # not copied, so the variants cost nothing on disk.
+    os.makedirs(bin_dir, exist_ok=True)
+    sources = [(f"{TEAM}-{COLOR}-{ART_TYPE}-{c}", lambda art, c=c: f"{TEAM}-{COLOR}-{art}-{c}") for c in CLASSES]
+    sources.append((ART_TYPE, lambda art: art))
+    for border_width in border_widths:
+        art = art_type_for(border_width)
+        for source, target_name in sources:
+            src = os.path.join(SOURCE_BIN_DIR, source)
+            dst = os.path.join(bin_dir, target_name(art))
+            os.makedirs(dst, exist_ok=True)
+            for name in ('blank.png', 'text.otf', 'number.ttf'):
+                link_or_copy(os.path.join(src, name), os.path.join(dst, name))
+            with open(os.path.join(src, 'coords.json'), 'r', encoding='utf-8') as f:
+                coords = json.load(f)
+            if border_width:
+                for field in ('Number', 'FirstName', 'LastName', 'Sport'):
+                    coords[field]['border'] = "True"
+                    coords[field]['border_width'] = border_width
+                    coords[field]['border_color'] = "#ffffff"
+            with open(os.path.join(dst, 'coords.json'), 'w', encoding='utf-8') as f:
+                json.dump(coords, f, indent=2)
+
+def link_or_copy(src, dst):
+    if os.path.exists(dst):
+        return
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+def make_synthetic_csv(path, rows, name_length=(3, 12), border_widths=(0,), repeat_rate=0.5,
+                       print_files=True, seed=0):
+    # Writes a catalog CSV in the generator's input format.
+    # name_length: (min, max) last-name length, uniform; first names run shorter
+    # border_widths: designs to spread rows across (see make_asset_bin)
+    # repeat_rate: chance a row reuses an earlier player (same text, new garment)
+    rng = random.Random(seed)
+    players = []
+    fieldnames = ['Name', 'Team', 'Color List', 'Art Type', 'Class', 'First Name', 'Last Name',
+                  'Jersey Number', 'Jersey Characters', 'Sport Specific', 'Player Name', 'Description']
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        writer.writeheader()
+        for i in range(rows):
+            if players and rng.random() < repeat_rate:
+                player = rng.choice(players)
+            else:
+                last = random_name(rng, rng.randint(*name_length))
+                first = random_name(rng, rng.randint(2, max(2, name_length[1] // 2 + 2)))
+                player = {
+                    'first': first,
+                    'last': last,
+                    'number': str(rng.randint(0, 99)),
+                    'sport': rng.choice(SPORTS),
+                    'art': art_type_for(rng.choice(border_widths)),
+                }
+                players.append(player)
+            garment = rng.choice(CLASSES)
+            full_name = f"{player['first']} {player['last']}"
+            writer.writerow({
+                'Name': f"BENCH-{i:06d}",
+                'Team': TEAM,
+                'Color List': COLOR,
+                'Art Type': player['art'],
+                'Class': f"Apparel: Tops: {garment}",
+                'First Name': player['first'],
+                'Last Name': player['last'],
+                'Jersey Number': player['number'],
+                'Jersey Characters': '',
+                'Sport Specific': player['sport'],
+                'Player Name': full_name if print_files else '',
+                'Description': f"{player['art']} {full_name}",
+            })
+
+def time_calls(fn, iterations, setup=None):
+    # Also starts the peak RSS that summarize reports for these samples
+    reset_peak_rss()
+    samples = []
+    for _ in range(iterations):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+def summarize(name, samples, rows=None):
+    result = {
+        "name": name,
+        "iterations": len(samples),
+        "mean_s": round(statistics.mean(samples), 6),
+        "median_s": round(statistics.median(samples), 6),
+        "min_s": round(min(samples), 6),
+    }
+    result["peak_rss_mb"], result["peak_rss_growth_mb"] = peak_rss_mb()
+    if rows:
+        result["rows"] = rows
+        result["rows_per_sec"] = round(rows / statistics.median(samples), 3)
+    return result
+
+def bench_renderers(bin_dir, border_widths, iterations, name_length, seed):
+    rng = random.Random(seed)
+    results = []
+    for border_width in border_widths:
+        asset_path = os.path.join(bin_dir, f"{TEAM}-{COLOR}-{art_type_for(border_width)}-{RENDER_CLASS}")
+        with open(os.path.join(asset_path, 'coords.json'), 'r', encoding='utf-8') as f:
+            coords, _ = generator.normalize_coords(json.load(f))
+        text_font = os.path.join(asset_path, 'text.otf')
+        number_font = os.path.join(asset_path, 'number.ttf')
+        blank = Image.open(os.path.join(asset_path, 'blank.png')).convert('RGBA')
+        first = random_name(rng, max(2, name_length[0])).upper()
+        last = random_name(rng, name_length[1]).upper()
+        sport = rng.choice(SPORTS)
+
+        cases = {
+            "number_render": lambda image: generator.number_render(image, coords['Number'], "18", number_font),
+            "first_name_render": lambda image: generator.first_name_render(image, coords['FirstName'], first, text_font, coords['Lines']),
+            "last_name_render": lambda image: generator.last_name_render(image, coords['LastName'], last, text_font),
+            "render_sport": lambda image: generator.render_sport(image, coords['Sport'], sport, text_font),
+        }
+        for name, render in cases.items():
+            canvas = blank.copy()
+            cold = time_calls(lambda: render(canvas), iterations, setup=generator.clear_caches)
+            results.append(summarize(f"{name}[bw={border_width},cold]", cold))
+            warm = time_calls(lambda: render(canvas), iterations)
+            results.append(summarize(f"{name}[bw={border_width},warm]", warm))
+
+        row = {'First Name': first, 'Last Name': last, 'Jersey Number': '18', 'Sport Specific': sport}
+        cold = time_calls(lambda: generator.build_image_from_assets(row, asset_path), iterations, setup=generator.clear_caches)
+        results.append(summarize(f"build_image_from_assets[bw={border_width},cold]", cold))
+        warm = time_calls(lambda: generator.build_image_from_assets(row, asset_path), iterations)
+        results.append(summarize(f"build_image_from_assets[bw={border_width},warm]", warm))
+    return results
+
+@contextlib.contextmanager
+def generator_dirs(work_dir, bin_dir):
+    # Points the generator's module-level paths at the benchmark's scratch tree
+    names = ('BIN_DIR', 'TEMPLATE_DIR', 'RENDER_CACHE_DIR', 'OUTPUT_DIR', 'WEB_DIR', 'PRINT_DIR', 'MANIFEST_PATH',
+             'SHARD_DIR')
+    saved = {name: getattr(generator, name) for name in names}
+    output_dir = os.path.join(work_dir, 'output')
+    generator.BIN_DIR = bin_dir
+    generator.TEMPLATE_DIR = os.path.join(work_dir, 'templates')
+    generator.RENDER_CACHE_DIR = os.path.join(work_dir, 'render-cache')
+    generator.OUTPUT_DIR = output_dir
+    generator.WEB_DIR = os.path.join(output_dir, 'web-images')
+    generator.PRINT_DIR = os.path.join(output_dir, 'printer-images')
+    generator.MANIFEST_PATH = os.path.join(output_dir, 'manifest.json')
+    generator.SHARD_DIR = os.path.join(output_dir, 'shards')
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            setattr(generator, name, value)
+
+def output_bytes(output_dir):
+    total = 0
+    for root, _, files in os.walk(output_dir):
+        for name in files:
+            if name != 'manifest.json':
+                total += os.path.getsize(os.path.join(root, name))
+    return total
+
+def output_pixels(output_dir):
+    # Sum of width * height over rendered images, read from their headers
+    total = 0
+    for root, _, files in os.walk(output_dir):
+        for name in files:
+            if name != 'manifest.json':
+                with Image.open(os.path.join(root, name)) as image:
+                    total += image.width * image.height
+    return total
+
+def kind_costs(output_dir, timings_path, median_s, batch_args):
+    # {kind: outputs, pixels, bytes, seconds and save settings} for a clean
+    # batch. Web and print files are saved with different settings, so
+    # generator.py --dry-run prices each kind on its own. median_s is split
+    # by each kind's share of the job time in a --timings run of the batch.
+    args = generator.parse_args(['-', *batch_args])
+    job_ms = dict.fromkeys(('web', 'print'), 0.0)
+    with open(timings_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            record = json.loads(line)
+            if record["type"] == "job":
+                # Background encodes are timed outside the job's total
+                encode = record["stages"].get("encode", {}).get("ms", 0)
+                job_ms[record["kind"]] += record["total_ms"] + encode
+    total_ms = sum(job_ms.values())
+    costs = {}
+    for kind, folder in (('web', 'web-images'), ('print', 'printer-images')):
+        kind_dir = os.path.join(output_dir, folder)
+        outputs = sum(len(files) for _, _, files in os.walk(kind_dir))
+        if not outputs:
+            continue
+        costs[kind] = {
+            "outputs": outputs,
+            "output_pixels": output_pixels(kind_dir),
+            "output_bytes": output_bytes(kind_dir),
+            "seconds": median_s * job_ms[kind] / total_ms if total_ms else 0.0,
+            "save": {"format": getattr(args, f'{kind}_format'),
+                     "compress_level": getattr(args, f'{kind}_compress_level')},
+        }
+    return costs
+
+def bench_batch(work_dir, bin_dir, csv_path, rows, iterations, batch_args):
+    # Full main()-equivalent runs: a clean render, an unchanged rerun, and a
+    # clean rerun served from the render cache
+    results = []
+    with generator_dirs(work_dir, bin_dir):
+        def run(extra):
+            with contextlib.redirect_stdout(io.StringIO()):
+                generator.main([csv_path, *batch_args, *extra])
+
+        def cold_start():
+            generator.clear_caches()
+            shutil.rmtree(generator.RENDER_CACHE_DIR, ignore_errors=True)
+
+        clean = time_calls(lambda: run(['--clean']), iterations, setup=cold_start)
+        result = summarize("batch[clean]", clean, rows)
+        result["output_bytes"] = output_bytes(generator.OUTPUT_DIR)
+        # generator.py --dry-run scales these to a planned batch
+        result["output_pixels"] = output_pixels(generator.OUTPUT_DIR)
+        timings_path = os.path.join(work_dir, 'timings.jsonl')
+        cold_start()
+        run(['--clean', '--timings', timings_path])
+        result["kinds"] = kind_costs(generator.OUTPUT_DIR, timings_path, result["median_s"], batch_args)
+        results.append(result)
+        rerun = time_calls(lambda: run([]), iterations)
+        results.append(summarize("batch[incremental-noop]", rerun, rows))
+        cached = time_calls(lambda: run(['--clean']), iterations, setup=generator.clear_caches)
+        results.append(summarize("batch[clean-cached]", cached, rows))
+    return results
+
+def compare(results, baseline_path):
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = {r["name"]: r for r in json.load(f)["results"]}
+    print(f"\nCompared with {baseline_path}:")
+    for r in results:
+        old = baseline.get(r["name"])
+        if not old:
+            continue
+        change = (r["median_s"] - old["median_s"]) / old["median_s"] * 100 if old["median_s"] else 0.0
+        print(f"  {r['name']:<50} {old['median_s']:>10.4f}s -> {r['median_s']:>10.4f}s  ({change:+.1f}%)")
+
+def parse_range(text):
+    low, _, high = text.partition(':')
+    low = int(low)
+    return (low, int(high) if high else low)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the apparel image generator on the real bin/ assets.")
+    parser.add_argument('--rows', type=int, default=40, help="rows in the synthetic batch CSV (default: 40)")
+    parser.add_argument('--name-length', type=parse_range, default=(3, 12), metavar='MIN:MAX',
+                        help="last-name length range, uniform (default: 3:12)")
+    parser.add_argument('--border-widths', default='0,2',
+                        help="comma-separated border widths to spread rows across (default: 0,2)")
+    parser.add_argument('--repeat-rate', type=float, default=0.5,
+                        help="chance a row reuses an earlier player (default: 0.5)")
+    parser.add_argument('--no-print-files', action='store_true',
+                        help="leave Player Name empty so batches render web images only")
+    parser.add_argument('--iterations', type=int, default=3, help="timed runs per benchmark (default: 3)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--skip-renderers', action='store_true', help="only run the batch benchmarks")
+    parser.add_argument('--skip-batch', action='store_true', help="only run the renderer benchmarks")
+    parser.add_argument('--output', default='bench_results.json',
+                        help="where to write machine-readable results (default: bench_results.json)")
+    parser.add_argument('--compare', metavar='RESULTS_JSON', help="print changes against an earlier results file")
+    parser.add_argument('batch_args', nargs=argparse.REMAINDER,
+                        help="arguments after -- are passed to generator.main for batch runs, e.g. -- --workers 4")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    border_widths = [int(w) for w in args.border_widths.split(',') if w.strip()]
+    batch_args = [a for a in args.batch_args if a != '--']
+    Image.MAX_IMAGE_PIXELS = None  # print blanks trip Pillow's decompression-bomb warning
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix='apparel-bench-') as work_dir:
+        bin_dir = os.path.join(work_dir, 'bin')
+        make_asset_bin(bin_dir, border_widths)
+        if not args.skip_renderers:
+            results += bench_renderers(bin_dir, border_widths, args.iterations, args.name_length, args.seed)
+        if not args.skip_batch:
+            csv_path = os.path.join(work_dir, 'bench.csv')
+            make_synthetic_csv(csv_path, args.rows, args.name_length, border_widths, args.repeat_rate,
+                               not args.no_print_files, args.seed)
+            results += bench_batch(work_dir, bin_dir, csv_path, args.rows, args.iterations, batch_args)
+
+    for r in results:
+        rate = f"  {r['rows_per_sec']:.2f} rows/s" if 'rows_per_sec' in r else ""
+        print(f"{r['name']:<50} median {r['median_s']:.4f}s  min {r['min_s']:.4f}s  peak RSS {r['peak_rss_mb']} MB (+{r['peak_rss_growth_mb']}){rate}")
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        "python": platform.python_version(),
+        "pillow": PIL.__version__,
+        "platform": platform.platform(),
+        "params": {
+            "rows": args.rows,
+            "name_length": list(args.name_length),
+            "border_widths": border_widths,
+            "repeat_rate": args.repeat_rate,
+            "print_files": not args.no_print_files,
+            "iterations": args.iterations,
+            "seed": args.seed,
+            "batch_args": batch_args,
+        },
+        "peak_rss_mb": run_peak_rss_mb(),
+        # False where per-case peaks could not be reset and are cumulative
+        "per_case_peak_rss": os.access('/proc/self/clear_refs', os.W_OK),
+        "results": results,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nWrote {args.output}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,32 @@
 #program to create NIL apparel images
 #Created by Dave Nissly
 
+import argparse
+import contextlib
+import cProfile
 import csv
+import hashlib
 import os
 import json
+import mmap
+import multiprocessing.util
+import pstats
+import queue
 import shutil
-from PIL import Image, ImageDraw, ImageFont
-from tkinter import Tk, filedialog
+import string
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from functools import lru_cache, wraps
+from PIL import Image, ImageChops, ImageColor, ImageDraw
+
+from text_layout import (
+    FIT_REFERENCE_SIZE, clear_caches as clear_layout_caches, font_stamp, glyph_table,
+    layout_block, layout_spaced, layout_stretched, load_font,
+)
 
 #TODO
 #space between name letters (spacing factor logic)
@@ -16,120 +36,546 @@ BIN_DIR = os.path.join(os.getcwd(), 'bin')
 OUTPUT_DIR = os.path.join(os.getcwd(), 'output')
 WEB_DIR = os.path.join(OUTPUT_DIR, 'web-images')        # main images
 PRINT_DIR = os.path.join(OUTPUT_DIR, 'printer-images')  # print files
+# Records the inputs behind every output so reruns only redo what changed
+MANIFEST_PATH = os.path.join(OUTPUT_DIR, 'manifest.json')
+# Partial manifests written by --shard runs, combined by `generator.py merge`
+SHARD_DIR = os.path.join(OUTPUT_DIR, 'shards')
+# Finished images keyed by what they were rendered from, shared across rows,
+# runs and CSVs (see --render-cache)
+RENDER_CACHE_DIR = os.path.join(os.getcwd(), 'render-cache')
+RENDER_CACHE_MAX_BYTES = 10 * 1024**3
+# benchmark.py results that --dry-run estimates render time and output size from
+BENCH_RESULTS_PATH = os.path.join(os.getcwd(), 'bench_results.json')
+
+# Bump whenever a change alters rendered pixels, so manifests from older
+# runs stop matching and their outputs get re-rendered.
+RENDERER_VERSION = 2
+ASSET_FILES = ('blank.png', 'coords.json', 'text.otf', 'number.ttf')
+
+# Compiled asset folders (`generator.py compile`): templates/<folder>/ holds
+# template.json (typed coords, source stamps, font metrics) and blank.rgba,
+# the blank as raw RGBA that loads through mmap instead of a PNG decode.
+TEMPLATE_DIR = os.path.join(os.getcwd(), 'templates')
+TEMPLATE_VERSION = 1
+# Characters whose reference-size metrics are stored with each template
+TEMPLATE_CHARSET = string.ascii_uppercase + string.digits + " .-'"
+
+# Encoding per output directory. compress_level is zlib's 0-9 for PNG; for
+# lossless WebP it is mapped onto the encoder's 0-6 method (effort) scale.
+OUTPUT_FORMATS = {'png': '.png', 'webp': '.webp'}
+DEFAULT_SAVE_SETTINGS = {
+    'web': {'format': 'png', 'compress_level': 1},    # fast, storefront images
+    'print': {'format': 'png', 'compress_level': 9},  # smallest, archived print files
+}
+# Finished canvases allowed to wait for the writer thread before rendering blocks
+WRITE_QUEUE_SIZE = 2
 
 # percent of the line bar width used as padding on EACH side of the name gap
 GAP_PADDING_PCT = 0.08  # 8% per side
 
+# Upper bound on decoded blanks kept in memory between rows. Print blanks are
+# ~400 MB once converted to RGBA, so the cache is sized in bytes, not entries.
+ASSET_CACHE_MAX_BYTES = 1536 * 1024 * 1024
+
+# Per-stage instrumentation. A run that asks for timings sets a record dict
+# on the rendering thread; with no record set every hook is a single check.
+_stage_state = threading.local()
+
+# Counters in a per-stage entry. alloc_blocks is the net change in Python
+# allocation blocks; Pillow's pixel buffers live outside the Python allocator,
+# so image_new (images created) and image_blocks (pixel memory blocks Pillow's
+# arena allocated, 16 MB each by default) come from Image.core.get_stats().
+# Those are process-wide, so they include work the writer thread did meanwhile.
+STAGE_COUNTERS = ("alloc_blocks", "image_new", "image_blocks")
+
+@contextlib.contextmanager
+def stage(name):
+    # Accumulates wall time, call count and the STAGE_COUNTERS deltas for
+    # name in the current thread's record. Nested stages are inclusive.
+    record = getattr(_stage_state, 'record', None)
+    if record is None:
+        yield
+        return
+    blocks = sys.getallocatedblocks()
+    pil_stats = Image.core.get_stats()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        entry = record.setdefault(name, dict({"ms": 0.0, "calls": 0}, **dict.fromkeys(STAGE_COUNTERS, 0)))
+        entry["ms"] += (time.perf_counter() - start) * 1000
+        entry["calls"] += 1
+        entry["alloc_blocks"] += sys.getallocatedblocks() - blocks
+        after = Image.core.get_stats()
+        entry["image_new"] += after["new_count"] - pil_stats["new_count"]
+        entry["image_blocks"] += after["allocated_blocks"] - pil_stats["allocated_blocks"]
+
+def timed_stage(name):
+    def decorate(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if getattr(_stage_state, 'record', None) is None:
+                return fn(*args, **kwargs)
+            with stage(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+def summarize_stage_records(records):
+    # Run-level percentiles of per-row stage times (ms), plus the row total,
+    # and each stage's Pillow allocations summed over the run
+    by_stage = {}
+    image_counts = {}
+    for record in records:
+        by_stage.setdefault("total", []).append(record["total_ms"])
+        for name, entry in record["stages"].items():
+            by_stage.setdefault(name, []).append(entry["ms"])
+            counts = image_counts.setdefault(name, [0, 0])
+            counts[0] += entry.get("image_new", 0)
+            counts[1] += entry.get("image_blocks", 0)
+    summary = {}
+    for name, values in by_stage.items():
+        summary[name] = {
+            "rows": len(values),
+            "p50_ms": round(percentile(values, 50), 3),
+            "p90_ms": round(percentile(values, 90), 3),
+            "p99_ms": round(percentile(values, 99), 3),
+            "max_ms": round(max(values), 3),
+            "sum_ms": round(sum(values), 3),
+        }
+        if name in image_counts:
+            summary[name]["image_new"], summary[name]["image_blocks"] = image_counts[name]
+    return summary
+
+class LRUCache:
+    # Least-recently-used cache bounded by the summed size of its values
+    def __init__(self, max_bytes, sizeof):
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+
+    def get(self, key):
+        value = self.entries.get(key)
+        if value is not None:
+            self.entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        size = self.sizeof(value)
+        if key in self.entries:
+            self.total_bytes -= self.sizeof(self.entries.pop(key))
+        if size > self.max_bytes:
+            return
+        self.entries[key] = value
+        self.total_bytes += size
+        while self.total_bytes > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.total_bytes -= self.sizeof(evicted)
+
+    def clear(self):
+        self.entries.clear()
+        self.total_bytes = 0
+
+def image_nbytes(image):
+    return image.width * image.height * len(image.getbands())
+
+# (asset_path, blank mtime, coords mtime, scale) -> (decoded RGBA blank, coords)
+_asset_cache = LRUCache(ASSET_CACHE_MAX_BYTES, lambda entry: image_nbytes(entry[0]))
+
+def scale_coords(coords, scale):
+    # Scales every box, line bar and border width in a coords.json dict.
+    # Font sizes follow the box heights and spacing factors are relative, so
+    # neither needs adjusting. Borders never scale away entirely.
+    if scale == 1:
+        return coords
+    scaled = {}
+    for name, field in coords.items():
+        if isinstance(field, dict):
+            field = dict(field)
+            for box_key in ('coords', 'y-coords'):
+                if box_key in field:
+                    field[box_key] = [int(round(v * scale)) for v in field[box_key]]
+            border_width = int(field.get('border_width', 0))
+            if border_width > 0:
+                field['border_width'] = max(1, int(round(border_width * scale)))
+        scaled[name] = field
+    return scaled
+
+def collapsed_fields(coords, scale):
+    # Names of the fields whose box has width and height at full size but
+    # rounds to nothing at scale; those fields cannot be fitted or drawn
+    scaled = scale_coords(coords, scale)
+    extents = {'coords': ((0, 2), (1, 3)), 'y-coords': ((0, 1),)}
+    names = []
+    for name, field in coords.items():
+        if not isinstance(field, dict):
+            continue
+        for box_key, pairs in extents.items():
+            if box_key not in field:
+                continue
+            box, scaled_box = field[box_key], scaled[name][box_key]
+            if any(box[hi] > box[lo] and scaled_box[hi] <= scaled_box[lo] for lo, hi in pairs):
+                names.append(name)
+                break
+    return names
+
+def collapsed_error(names, scale):
+    return f"scale {scale} is too small: the {', '.join(names)} {'box rounds' if len(names) == 1 else 'boxes round'} to 0 px"
+
+def normalize_coords(raw):
+    # Typed copy of a coords.json dict: boxes as ints, border as a bool,
+    # border_width as an int, spacing_factor as a float, and every colour
+    # checked. Returns (coords, err).
+    coords = {}
+    for name, field in raw.items():
+        if not isinstance(field, dict):
+            coords[name] = field
+            continue
+        field = dict(field)
+        try:
+            for key, length in (('coords', 4), ('y-coords', 2)):
+                if key in field:
+                    if len(field[key]) != length:
+                        raise ValueError(f"{key} needs {length} values")
+                    field[key] = [int(v) for v in field[key]]
+            if 'border' in field:
+                field['border'] = str(field['border']) == 'True'
+            if 'border_width' in field:
+                field['border_width'] = int(field['border_width'])
+            if 'spacing_factor' in field:
+                field['spacing_factor'] = float(field['spacing_factor'])
+            for key in ('color', 'border_color'):
+                if key in field:
+                    ImageColor.getrgb(field[key])
+        except (TypeError, ValueError) as e:
+            return None, f"coords.json {name}: {e}"
+        coords[name] = field
+    return coords, None
+
+def template_path(asset_path):
+    return os.path.join(TEMPLATE_DIR, os.path.basename(asset_path))
+
+def source_stamps(asset_path):
+    # {file name: [mtime_ns, size]} for the asset folder, None if a file is missing
+    stamps = {}
+    for name in ASSET_FILES:
+        try:
+            st = os.stat(os.path.join(asset_path, name))
+        except FileNotFoundError:
+            return None
+        stamps[name] = [st.st_mtime_ns, st.st_size]
+    return stamps
+
+@lru_cache(maxsize=64)
+def _open_template(path, mtime_ns):
+    with open(os.path.join(path, 'template.json'), 'r', encoding='utf-8') as f:
+        template = json.load(f)
+    if template.get("version") != TEMPLATE_VERSION:
+        return None
+    with open(os.path.join(path, 'blank.rgba'), 'rb') as f:
+        # Read-only shared mapping: every process rendering this blank reads
+        # the same page-cache pages, and nothing is decoded.
+        pages = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    width, height = template["size"]
+    if len(pages) != width * height * 4:
+        return None
+    template["blank"] = Image.frombuffer('RGBA', (width, height), pages, 'raw', 'RGBA', 0, 1)
+    return template
+
+def load_template(asset_path):
+    # Compiled template for an asset folder, or None when there is none or
+    # any source file changed after it was compiled
+    path = template_path(asset_path)
+    try:
+        mtime = os.stat(os.path.join(path, 'template.json')).st_mtime_ns
+        template = _open_template(path, mtime)
+    except (OSError, ValueError, KeyError):
+        return None
+    if template is None or template["sources"] != source_stamps(asset_path):
+        return None
+    table = glyph_table(os.path.join(asset_path, 'text.otf'), FIT_REFERENCE_SIZE)
+    table.seed(template["text_metrics"])
+    return template
+
+def compile_template(asset_path):
+    # Validates an asset folder and writes its template. Returns err or None.
+    stamps = source_stamps(asset_path)
+    if stamps is None:
+        missing = [n for n in ASSET_FILES if not os.path.exists(os.path.join(asset_path, n))]
+        return f"{', '.join(missing)} missing"
+    try:
+        with open(os.path.join(asset_path, 'coords.json'), 'r', encoding='utf-8') as f:
+            coords, err = normalize_coords(json.load(f))
+    except ValueError as e:
+        return f"coords.json: {e}"
+    if err:
+        return err
+    text_font_path = os.path.join(asset_path, 'text.otf')
+    try:
+        load_font(os.path.join(asset_path, 'number.ttf'), FIT_REFERENCE_SIZE)
+        text_table = glyph_table(text_font_path, FIT_REFERENCE_SIZE)
+        text_metrics = dict(zip(TEMPLATE_CHARSET, text_table.metrics(TEMPLATE_CHARSET)))
+    except OSError as e:
+        return f"font: {e}"
+    try:
+        blank = Image.open(os.path.join(asset_path, 'blank.png')).convert('RGBA')
+    except OSError as e:
+        return f"blank.png: {e}"
+
+    path = template_path(asset_path)
+    os.makedirs(path, exist_ok=True)
+    # Written in bands so the raw copy never holds a second full-size buffer
+    band = 256
+    with open(os.path.join(path, 'blank.rgba.tmp'), 'wb') as f:
+        for top in range(0, blank.height, band):
+            f.write(blank.crop((0, top, blank.width, min(blank.height, top + band))).tobytes())
+    os.replace(os.path.join(path, 'blank.rgba.tmp'), os.path.join(path, 'blank.rgba'))
+
+    template = {
+        "version": TEMPLATE_VERSION,
+        "size": list(blank.size),
+        "coords": coords,
+        "fonts": {"text": 'text.otf', "number": 'number.ttf'},
+        "text_metrics": text_metrics,
+        "sources": stamps,
+        "digests": {
+            name: _file_digest(os.path.join(asset_path, name), *stamps[name])
+            for name in ASSET_FILES
+        },
+    }
+    with open(os.path.join(path, 'template.json.tmp'), 'w', encoding='utf-8') as f:
+        json.dump(template, f, indent=2, sort_keys=True)
+    os.replace(os.path.join(path, 'template.json.tmp'), os.path.join(path, 'template.json'))
+    return None
+
+@timed_stage("load_assets")
+def load_assets(asset_path, scale=1):
+    # Returns (image, coords, err); image is a private copy safe to draw on.
+    # With scale below 1 both the blank and coords are resized to match, and
+    # only the downsampled blank is kept in the cache. A current compiled
+    # template is used in place of the loose files when there is one.
+    template = load_template(asset_path)
+    if template is not None:
+        base, coords = template["blank"], template["coords"]
+        collapsed = collapsed_fields(coords, scale) if scale != 1 else []
+        if collapsed:
+            return None, None, collapsed_error(collapsed, scale)
+        if scale == 1:
+            with stage("copy_blank"):
+                return base.copy(), coords, None
+        key = (template_path(asset_path), json.dumps(template["sources"]), scale)
+        cached = _asset_cache.get(key)
+        if cached is None:
+            size = (max(1, round(base.width * scale)), max(1, round(base.height * scale)))
+            cached = (base.resize(size, Image.LANCZOS, reducing_gap=3.0), scale_coords(coords, scale))
+            _asset_cache.put(key, cached)
+        base, coords = cached
+        return base.copy(), coords, None
+
+    blank_img_path = os.path.join(asset_path, 'blank.png')
+    coords_path = os.path.join(asset_path, 'coords.json')
+    try:
+        blank_mtime = os.stat(blank_img_path).st_mtime_ns
+    except FileNotFoundError:
+        return None, None, "blank.png missing"
+    try:
+        coords_mtime = os.stat(coords_path).st_mtime_ns
+    except FileNotFoundError:
+        return None, None, "coords.json missing"
+
+    key = (asset_path, blank_mtime, coords_mtime, scale)
+    cached = _asset_cache.get(key)
+    if cached is None:
+        # coords first: a scale that collapses a box is refused before decoding
+        try:
+            with open(coords_path, 'r', encoding='utf-8') as f:
+                coords, err = normalize_coords(json.load(f))
+        except FileNotFoundError:
+            return None, None, "coords.json missing"
+        if err:
+            return None, None, err
+        collapsed = collapsed_fields(coords, scale) if scale != 1 else []
+        if collapsed:
+            return None, None, collapsed_error(collapsed, scale)
+        try:
+            with stage("decode_blank"):
+                base = Image.open(blank_img_path).convert('RGBA')
+        except FileNotFoundError:
+            return None, None, "blank.png missing"
+        if scale != 1:
+            size = (max(1, round(base.width * scale)), max(1, round(base.height * scale)))
+            base = base.resize(size, Image.LANCZOS, reducing_gap=3.0)
+            coords = scale_coords(coords, scale)
+        cached = (base, coords)
+        _asset_cache.put(key, cached)
+    base, coords = cached
+    return base.copy(), coords, None
+
+# Finished glyph bitmaps for the stretched per-character renderers. Names and
+# sport strings reuse the same handful of uppercase letters across rows.
+GLYPH_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+# (font path, font stamp, size, char, target width, target height) -> L coverage mask.
+# Glyphs are painted by pushing a fill colour through the mask, so one entry
+# serves every colour.
+_glyph_cache = LRUCache(GLYPH_CACHE_MAX_BYTES, image_nbytes)
+
+@timed_stage("glyph")
+def render_stretched_glyph(font_path, font_size, char, char_width, target_width, target_height):
+    # Draws one glyph, crops it to its ink and resamples it to the target box.
+    # The returned mask is shared through the cache and must not be modified.
+    key = (font_path, font_stamp(font_path), font_size, char, target_width, target_height)
+    char_img = _glyph_cache.get(key)
+    if char_img is None:
+        font = load_font(font_path, font_size)
+        char_img = Image.new("L", (max(1, char_width * 2), font_size * 2), 0)
+        char_draw = ImageDraw.Draw(char_img)
+        char_draw.text((0,0), char, font=font, fill=255)
+        char_bbox = char_img.getbbox()
+        if char_bbox:
+            char_img = char_img.crop(char_bbox)
+        char_img = char_img.resize((target_width, target_height), Image.LANCZOS)
+        _glyph_cache.put(key, char_img)
+    return char_img
+
+def stretched_glyphs(layout, text, x):
+    # [(x, glyph mask)] for a stretched layout whose run starts at x
+    return [
+        (x + offset, render_stretched_glyph(layout.font_path, layout.font_size, char,
+                                            char_width, glyph_width, layout.height))
+        for char, char_width, glyph_width, offset
+        in zip(text, layout.char_widths, layout.glyph_widths, layout.offsets)
+    ]
+
+@timed_stage("border")
+def dilate_mask(mask, radius):
+    # Dilates mask over a (2*radius+1) square, combining the shifted copies
+    # the way repeated alpha pastes do: coverage = 1 - prod(1 - m). A product
+    # over a square is separable, so this is 4*radius image ops rather than
+    # (2*radius+1)**2. Pixels shifted in from outside the mask count as empty.
+    clear = ImageChops.invert(mask)
+    for axis in (0, 1):
+        product = clear
+        for d in range(1, radius + 1):
+            for offset in (d, -d):
+                shifted = Image.new('L', mask.size, 255)
+                shifted.paste(clear, (offset, 0) if axis == 0 else (0, offset))
+                product = ImageChops.multiply(product, shifted)
+        clear = product
+    return ImageChops.invert(clear)
+
+def glyph_run_mask(glyphs, y, pad):
+    # glyphs: [(x, glyph mask)] placed at row y. Returns (mask, origin): one
+    # coverage mask for the whole run with pad empty pixels on every side,
+    # e.g. for a border to grow into.
+    left = min(x for x, _ in glyphs) - pad
+    top = y - pad
+    right = max(x + glyph.width for x, glyph in glyphs) + pad
+    bottom = y + max(glyph.height for _, glyph in glyphs) + pad
+    mask = Image.new('L', (right - left, bottom - top), 0)
+    for x, glyph in glyphs:
+        box = (x - left, y - top, x - left + glyph.width, y - top + glyph.height)
+        mask.paste(ImageChops.lighter(mask.crop(box), glyph), box)
+    return mask, (left, top)
+
+@timed_stage("composite_field")
+def composite_field(image, origin, fill_mask, color, border_mask=None, border_color=None):
+    # Colours one field's coverage masks (same size, placed at origin) into a
+    # box-sized RGBA and composites it onto image in a single operation.
+    # The border goes under the fill, as if the text were redrawn at every
+    # offset within the border width and then once more on top.
+    field = Image.new('RGBA', fill_mask.size, (0, 0, 0, 0))
+    if border_mask is not None:
+        field.paste(border_color, (0, 0), border_mask)
+    field.paste(color, (0, 0), fill_mask)
+    x, y = origin
+    if x < 0 or y < 0:
+        # alpha_composite only takes non-negative destinations
+        field = field.crop((max(0, -x), max(0, -y), field.width, field.height))
+        x, y = max(0, x), max(0, y)
+    image.alpha_composite(field, (x, y))
+
+def composite_glyph_run(image, glyphs, y, color, border, border_color, border_width):
+    if not glyphs:
+        return
+    pad = border_width if border and border_width > 0 else 0
+    mask, origin = glyph_run_mask(glyphs, y, pad)
+    border_mask = dilate_mask(mask, pad) if pad else None
+    composite_field(image, origin, mask, color, border_mask, border_color)
+
+# Finished decoration layers (all text and line bars for one set of values),
+# shared across garment variants that only differ in blank.png
+LAYER_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+# (blank size, coords, font digests, text fields) -> (layer, offset) or (None, None)
+_layer_cache = LRUCache(LAYER_CACHE_MAX_BYTES, lambda entry: image_nbytes(entry[0]) if entry[0] else 0)
+
+@timed_stage("number_render")
 def number_render(image, coords, number, font_path):
-    draw = ImageDraw.Draw(image)
     x1, y1, x2, y2 = coords.get('coords', [0,0,0,0])
     box_width = x2 - x1
     box_height = y2 - y1
     color = coords.get('color', '#ffffff')
-    border = coords.get('border', 'False') == 'True'
+    border = coords.get('border', False)
     border_color = coords.get('border_color', '#000000')
-    border_width = int(coords.get('border_width', 0))
+    border_width = coords.get('border_width', 0)
 
-    font_size = box_height
-    font = ImageFont.truetype(font_path, font_size)
-    bbox = font.getbbox(number)
-    text_width = bbox[2] - bbox[0]
-    text_height = bbox[3] - bbox[1]
-
-    while text_height > box_height and font_size > 1:
-        font_size -= 1
-        font = ImageFont.truetype(font_path, font_size)
-        bbox = font.getbbox(number)
-        text_width = bbox[2] - bbox[0]
-        text_height = bbox[3] - bbox[1]
+    with stage("layout"):
+        layout = layout_block(font_path, number, box_height)
+    font = layout.font
+    bbox = layout.bbox
+    text_width = layout.width
+    text_height = layout.height
 
     text_x = x1 + (box_width - text_width) // 2
     text_y = y1 + (box_height - text_height) // 2
 
-    if border and border_width > 0:
-        for dx in range(-border_width, border_width+1):
-            for dy in range(-border_width, border_width+1):
-                if dx == 0 and dy == 0:
-                    continue
-                draw.text((text_x+dx, text_y+dy), number, font=font, fill=border_color)
-
-    draw.text((text_x, text_y), number, font=font, fill=color)
+    # Coverage mask of the number's ink, padded for the border to grow into
+    pad = border_width if border and border_width > 0 else 0
+    mask = Image.new('L', (text_width + 2 * pad, text_height + 2 * pad), 0)
+    ImageDraw.Draw(mask).text((pad - bbox[0], pad - bbox[1]), number, font=font, fill=255)
+    origin = (text_x + bbox[0] - pad, text_y + bbox[1] - pad)
+    border_mask = dilate_mask(mask, pad) if pad else None
+    composite_field(image, origin, mask, color, border_mask, border_color)
 
+@timed_stage("first_name_render")
 def first_name_render(image, coords, first_name, font_path, lines_coords):
     y1, y2 = coords.get('y-coords', [0, 0])
     box_height = y2 - y1
     color = coords.get('color', '#ffffff')
-    border = coords.get('border', 'False') == 'True'
+    border = coords.get('border', False)
     border_color = coords.get('border_color', '#000000')
-    border_width = int(coords.get('border_width', 0))
-    spacing_factor = float(coords.get('spacing_factor', 0))
-
-    min_font_size = 1
-    max_font_size = max(1, box_height)
-    best_font_size = min_font_size
-
-    def get_text_size(text, font, spacing):
-        width = 0
-        max_height = 0
-        char_widths = []
-        for i, char in enumerate(text):
-            bbox = font.getbbox(char)
-            char_width = bbox[2] - bbox[0]
-            char_height = bbox[3] - bbox[1]
-            char_widths.append(char_width)
-            width += char_width
-            max_height = max(max_height, char_height)
-            if i < len(text) - 1:
-                width += int(char_width * spacing)
-        return width, max_height, char_widths
-
-    while min_font_size <= max_font_size:
-        mid_font_size = (min_font_size + max_font_size) // 2
-        font = ImageFont.truetype(font_path, mid_font_size)
-        _, text_height, _ = get_text_size(first_name, font, spacing_factor)
-        if text_height <= box_height:
-            best_font_size = mid_font_size
-            min_font_size = mid_font_size + 1
-        else:
-            max_font_size = mid_font_size - 1
+    border_width = coords.get('border_width', 0)
+    spacing_factor = coords.get('spacing_factor', 0)
 
-    font = ImageFont.truetype(font_path, best_font_size)
-    ascent, descent = font.getmetrics()
-    _, _, char_widths = get_text_size(first_name, font, spacing_factor)
-    num_gaps = max(len(first_name) - 1, 0)
-    total_char_width = sum(char_widths)
-    total_spacing = sum(int(char_widths[i] * spacing_factor) for i in range(num_gaps))
-    name_width = total_char_width + total_spacing
-    true_text_height = ascent + descent
+    with stage("layout"):
+        layout = layout_spaced(font_path, first_name, box_height, spacing_factor)
+    font = layout.font
+    name_width = layout.width
 
-    text_img = Image.new("RGBA", (name_width, true_text_height), (0, 0, 0, 0))
-    text_draw = ImageDraw.Draw(text_img)
+    # The name is laid out as a coverage mask at its natural height, then
+    # stretched vertically to the box. The outline is clipped to the same
+    # rectangle as the name.
+    text_mask = Image.new("L", (name_width, layout.height), 0)
+    text_draw = ImageDraw.Draw(text_mask)
+    for char, x in zip(first_name, layout.offsets):
+        text_draw.text((x, 0), char, font=font, fill=255)
 
-    if border and border_width > 0:
-        for dx in range(-border_width, border_width + 1):
-            for dy in range(-border_width, border_width + 1):
-                if dx == 0 and dy == 0:
-                    continue
-                cx = 0
-                for i, char in enumerate(first_name):
-                    text_draw.text((cx + dx, dy), char, font=font, fill=border_color)
-                    char_width = char_widths[i]
-                    cx += char_width
-                    if i < len(first_name) - 1:
-                        cx += int(char_width * spacing_factor)
-
-    cx = 0
-    for i, char in enumerate(first_name):
-        text_draw.text((cx, 0), char, font=font, fill=color)
-        char_width = char_widths[i]
-        cx += char_width
-        if i < len(first_name) - 1:
-            cx += int(char_width * spacing_factor)
-
-    stretched_img = text_img.resize((name_width, box_height), Image.LANCZOS)
     image_width = image.width
     center_x = (image_width - name_width) // 2
-    image.paste(stretched_img, (center_x, y1), stretched_img)
+    border_mask = None
+    if border and border_width > 0:
+        border_mask = dilate_mask(text_mask, border_width).resize((name_width, box_height), Image.LANCZOS)
+    stretched_mask = text_mask.resize((name_width, box_height), Image.LANCZOS)
+    composite_field(image, (center_x, y1), stretched_mask, color, border_mask, border_color)
     draw_lines(image, name_width, lines_coords)
 
 def draw_lines(image, name_width, coords):
@@ -153,197 +599,44 @@ def draw_lines(image, name_width, coords):
     if gap_right < x2:
         draw.rectangle([gap_right, y1, x2, y2], fill=color)
 
+@timed_stage("last_name_render")
 def last_name_render(image, coords, last_name, font_path):
-    draw = ImageDraw.Draw(image)
     x1, y1, x2, y2 = coords.get('coords', [0,0,0,0])
     box_width = x2 - x1
     box_height = y2 - y1
     color = coords.get('color', '#ffffff')
-    border = coords.get('border', 'False') == 'True'
+    border = coords.get('border', False)
     border_color = coords.get('border_color', '#000000')
-    border_width = int(coords.get('border_width', 0))
-    base_spacing_factor = float(coords.get('spacing_factor', 0))
-
-    def get_text_size(text, font, spacing):
-        width = 0
-        max_height = 0
-        char_widths = []
-        for i, char in enumerate(text):
-            bbox = font.getbbox(char)
-            char_width = bbox[2] - bbox[0]
-            char_height = bbox[3] - bbox[1]
-            char_widths.append(char_width)
-            width += char_width
-            max_height = max(max_height, char_height)
-            if i < len(text) - 1:
-                width += int(char_width * spacing)
-        return width, max_height, char_widths
-
-    min_font_size = 1
-    max_font_size = max(1, box_height)
-    best_font_size = min_font_size
-    while min_font_size <= max_font_size:
-        mid_font_size = (min_font_size + max_font_size) // 2
-        font = ImageFont.truetype(font_path, mid_font_size)
-        _, text_height, _ = get_text_size(last_name, font, base_spacing_factor)
-        if text_height <= box_height:
-            best_font_size = mid_font_size
-            min_font_size = mid_font_size + 1
-        else:
-            max_font_size = mid_font_size - 1
-
-    font = ImageFont.truetype(font_path, best_font_size)
-    _, _, char_widths = get_text_size(last_name, font, 0)
-    num_gaps = max(len(last_name) - 1, 0)
-    total_char_width = sum(char_widths)
-    total_spacing = sum(int(char_widths[i] * base_spacing_factor) for i in range(num_gaps))
-    total_unstretched_width = total_char_width + total_spacing
-    max_stretch = 5
-    stretch_factor = min(box_width / total_unstretched_width, max_stretch)
-    stretched_total_width = total_unstretched_width * stretch_factor
-    text_x = x1 + (box_width - stretched_total_width) // 2
+    border_width = coords.get('border_width', 0)
+    base_spacing_factor = coords.get('spacing_factor', 0)
+
+    with stage("layout"):
+        layout = layout_stretched(font_path, last_name, box_width, box_height, base_spacing_factor, max_stretch=5)
+    text_x = int(x1 + (box_width - layout.width) // 2)
     text_y = y1
 
-    if border and border_width > 0:
-        for dx in range(-border_width, border_width+1):
-            for dy in range(-border_width, border_width+1):
-                if dx == 0 and dy == 0:
-                    continue
-                cx = text_x
-                for i, char in enumerate(last_name):
-                    char_width = char_widths[i]
-                    stretched_char_width = int(char_width * stretch_factor)
-                    char_img = Image.new("RGBA", (char_width * 2, best_font_size * 2), (0,0,0,0))
-                    char_draw = ImageDraw.Draw(char_img)
-                    char_draw.text((0,0), char, font=font, fill=border_color)
-                    char_bbox = char_img.getbbox()
-                    if char_bbox:
-                        char_img = char_img.crop(char_bbox)
-                    char_img = char_img.resize((stretched_char_width, box_height), Image.LANCZOS)
-                    image.paste(char_img, (int(cx+dx), int(text_y+dy)), char_img)
-                    cx += stretched_char_width
-                    if i < len(last_name) - 1:
-                        spacing = int(char_widths[i] * base_spacing_factor * stretch_factor)
-                        cx += spacing
-
-    cx = text_x
-    for i, char in enumerate(last_name):
-        char_width = char_widths[i]
-        stretched_char_width = int(char_width * stretch_factor)
-        char_img = Image.new("RGBA", (char_width * 2, best_font_size * 2), (0,0,0,0))
-        char_draw = ImageDraw.Draw(char_img)
-        char_draw.text((0,0), char, font=font, fill=color)
-        char_bbox = char_img.getbbox()
-        if char_bbox:
-            char_img = char_img.crop(char_bbox)
-        char_img = char_img.resize((stretched_char_width, box_height), Image.LANCZOS)
-        image.paste(char_img, (int(cx), int(text_y)), char_img)
-        cx += stretched_char_width
-        if i < len(last_name) - 1:
-            spacing = int(char_widths[i] * base_spacing_factor * stretch_factor)
-            cx += spacing
+    glyphs = stretched_glyphs(layout, last_name, text_x)
+    composite_glyph_run(image, glyphs, text_y, color, border, border_color, border_width)
 
+@timed_stage("render_sport")
 def render_sport(image, coords, sport_text, font_path):
-    draw = ImageDraw.Draw(image)
     x1, y1, x2, y2 = coords.get('coords', [0,0,0,0])
     box_width = x2 - x1
     box_height = y2 - y1
     color = coords.get('color', '#ffffff')
-    border = coords.get('border', 'False') == 'True'
+    border = coords.get('border', False)
     border_color = coords.get('border_color', '#000000')
-    border_width = int(coords.get('border_width', 0))
-    base_spacing_factor = float(coords.get('spacing_factor', 0))
-
-    def get_text_size(text, font, spacing):
-        width = 0
-        max_height = 0
-        char_widths = []
-        for i, char in enumerate(text):
-            bbox = font.getbbox(char)
-            char_width = bbox[2] - bbox[0]
-            char_height = bbox[3] - bbox[1]
-            char_widths.append(char_width)
-            width += char_width
-            max_height = max(max_height, char_height)
-            if i < len(text) - 1:
-                width += int(char_width * spacing)
-        return width, max_height, char_widths
-
-    min_font_size = 1
-    max_font_size = max(1, box_height)
-    best_font_size = min_font_size
-    while min_font_size <= max_font_size:
-        mid_font_size = (min_font_size + max_font_size)//2
-        font = ImageFont.truetype(font_path, mid_font_size)
-        _, text_height, _ = get_text_size(sport_text, font, base_spacing_factor)
-        if text_height <= box_height:
-            best_font_size = mid_font_size
-            min_font_size = mid_font_size + 1
-        else:
-            max_font_size = mid_font_size - 1
-
-    font = ImageFont.truetype(font_path, best_font_size)
-    _, _, char_widths = get_text_size(sport_text, font, 0)
-    num_gaps = max(len(sport_text) - 1, 0)
-    total_char_width = sum(char_widths)
-    min_spacings = [int(char_widths[i] * base_spacing_factor) for i in range(num_gaps)]
-    total_min_spacing = sum(min_spacings)
-    total_unstretched_width = total_char_width + total_min_spacing
-    max_stretch = 2.4
-    stretch_factor = min(box_width / total_unstretched_width, max_stretch)
-    stretched_total_width = total_unstretched_width * stretch_factor
-
-    if stretched_total_width < box_width and num_gaps > 0:
-        extra_space = box_width - stretched_total_width
-        extra_spacing_per_gap = extra_space // num_gaps
-        extra_spacing_remainder = extra_space % num_gaps
-        spacings = [
-            int(min_spacings[i] * stretch_factor) + extra_spacing_per_gap + (1 if i < extra_spacing_remainder else 0)
-            for i in range(num_gaps)
-        ]
-        stretched_char_widths = [int(w * stretch_factor) for w in char_widths]
-        stretched_total_width = box_width
-    else:
-        spacings = [int(min_spacings[i] * stretch_factor) for i in range(num_gaps)]
-        stretched_char_widths = [int(w * stretch_factor) for w in char_widths]
+    border_width = coords.get('border_width', 0)
+    base_spacing_factor = coords.get('spacing_factor', 0)
 
-    text_x = x1 + (box_width - stretched_total_width) // 2
+    with stage("layout"):
+        layout = layout_stretched(font_path, sport_text, box_width, box_height, base_spacing_factor,
+                                  max_stretch=2.4, justify=True)
+    text_x = int(x1 + (box_width - layout.width) // 2)
     text_y = y1
 
-    if border and border_width > 0:
-        for dx in range(-border_width, border_width+1):
-            for dy in range(-border_width, border_width+1):
-                if dx == 0 and dy == 0:
-                    continue
-                cx = text_x
-                for i, char in enumerate(sport_text):
-                    stretched_char_width = stretched_char_widths[i]
-                    char_img = Image.new("RGBA", (char_widths[i]*2, best_font_size*2), (0,0,0,0))
-                    char_draw = ImageDraw.Draw(char_img)
-                    char_draw.text((0,0), char, font=font, fill=border_color)
-                    char_bbox = char_img.getbbox()
-                    if char_bbox:
-                        char_img = char_img.crop(char_bbox)
-                    char_img = char_img.resize((stretched_char_width, box_height), Image.LANCZOS)
-                    image.paste(char_img, (int(cx+dx), int(text_y+dy)), char_img)
-                    cx += stretched_char_width
-                    if i < num_gaps:
-                        cx += spacings[i]
-
-    cx = text_x
-    for i, char in enumerate(sport_text):
-        stretched_char_width = stretched_char_widths[i]
-        char_img = Image.new("RGBA", (char_widths[i]*2, best_font_size*2), (0,0,0,0))
-        char_draw = ImageDraw.Draw(char_img)
-        char_draw.text((0,0), char, font=font, fill=color)
-        char_bbox = char_img.getbbox()
-        if char_bbox:
-            char_img = char_img.crop(char_bbox)
-        char_img = char_img.resize((stretched_char_width, box_height), Image.LANCZOS)
-        image.paste(char_img, (int(cx), int(text_y)), char_img)
-        cx += stretched_char_width
-        if i < num_gaps:
-            cx += spacings[i]
+    glyphs = stretched_glyphs(layout, sport_text, text_x)
+    composite_glyph_run(image, glyphs, text_y, color, border, border_color, border_width)
 
 def get_asset_folder(row):
     team = row['Team']
@@ -354,37 +647,124 @@ def get_asset_folder(row):
     class_text = class_parts[2] if len(class_parts) > 2 else class_parts[-1]
     return f"{team}-{color}-{art_type}-{class_text}"
 
-def build_image_from_assets(row, asset_path):
-    blank_img_path = os.path.join(asset_path, 'blank.png')
-    coords_path = os.path.join(asset_path, 'coords.json')
-    text_font_path = os.path.join(asset_path, 'text.otf')
-    number_font_path = os.path.join(asset_path, 'number.ttf')
-
-    try:
-        image = Image.open(blank_img_path).convert('RGBA')
-    except FileNotFoundError:
-        return None, "blank.png missing"
-    try:
-        with open(coords_path, 'r', encoding='utf-8') as f:
-            coords = json.load(f)
-    except FileNotFoundError:
-        return None, "coords.json missing"
-
+def row_text_fields(row):
+    # Normalized text values that end up on the garment, in render order
     first_name = (row.get('First Name') or '').strip().upper()
     last_name = (row.get('Last Name') or '').strip().upper()
     # Use Jersey Number, fall back to Jersey Characters
     jersey_value = (row.get('Jersey Number') or row.get('Jersey Characters') or '').strip()
+    sport_text = (row.get('Sport Specific') or '').upper()
+    return jersey_value, first_name, last_name, sport_text
+
+def decoration_rows(coords, height):
+    # Vertical span [top, bottom) that every field, border and line bar falls in
+    tops, bottoms, border_widths = [], [], [0]
+    for field in coords.values():
+        if not isinstance(field, dict):
+            continue
+        if 'coords' in field:
+            _, y1, _, y2 = field['coords']
+        elif 'y-coords' in field:
+            y1, y2 = field['y-coords']
+        else:
+            continue
+        tops.append(y1)
+        bottoms.append(y2)
+        border_widths.append(int(field.get('border_width', 0)))
+    if not tops:
+        return 0, 0
+    pad = max(border_widths) + 2
+    return max(0, min(tops) - pad), min(height, max(bottoms) + pad)
+
+def shift_coords(coords, dy):
+    shifted = {}
+    for name, field in coords.items():
+        if isinstance(field, dict):
+            field = dict(field)
+            if 'coords' in field:
+                x1, y1, x2, y2 = field['coords']
+                field['coords'] = [x1, y1 + dy, x2, y2 + dy]
+            if 'y-coords' in field:
+                y1, y2 = field['y-coords']
+                field['y-coords'] = [y1 + dy, y2 + dy]
+        shifted[name] = field
+    return shifted
+
+@timed_stage("render_decoration")
+def render_decoration(size, coords, fields, text_font_path, number_font_path):
+    # Renders every text field and the line bars onto a transparent strip the
+    # width of the blank. Returns (straight-alpha RGBA layer, (x, y) offset) with
+    # the layer cropped to its ink, or (None, None) if nothing was drawn.
+    width, height = size
+    top, bottom = decoration_rows(coords, height)
+    if bottom <= top:
+        return None, None
+    layer = Image.new('RGBA', (width, bottom - top), (0, 0, 0, 0))
+    coords = shift_coords(coords, -top)
+    jersey_value, first_name, last_name, sport_text = fields
 
     if jersey_value:
-        number_render(image, coords.get('Number', {}), jersey_value, number_font_path)
+        number_render(layer, coords.get('Number', {}), jersey_value, number_font_path)
     if first_name:
-        first_name_render(image, coords.get('FirstName', {}), first_name, text_font_path, coords.get("Lines", {}))
+        first_name_render(layer, coords.get('FirstName', {}), first_name, text_font_path, coords.get("Lines", {}))
     if last_name:
-        last_name_render(image, coords.get('LastName', {}), last_name, text_font_path)
-    render_sport(image, coords.get('Sport', {}), (row.get('Sport Specific') or '').upper(), text_font_path)
+        last_name_render(layer, coords.get('LastName', {}), last_name, text_font_path)
+    if sport_text:
+        render_sport(layer, coords.get('Sport', {}), sport_text, text_font_path)
+
+    # Every field is composited with "over" (line bars are opaque fills). Over
+    # is associative, so compositing the finished layer onto a blank matches
+    # drawing each field onto it directly.
+    bbox = layer.getbbox()
+    if not bbox:
+        return None, None
+    return layer.crop(bbox), (bbox[0], bbox[1] + top)
+
+def _font_digest(font_path):
+    st = os.stat(font_path)
+    return _file_digest(font_path, st.st_mtime_ns, st.st_size)
+
+def decoration_layer(size, coords, fields, text_font_path, number_font_path):
+    # Garment variants of one design share coords and fonts and only differ in
+    # blank.png, so the layer is keyed by content rather than by asset folder.
+    key = (
+        size,
+        json.dumps(coords, sort_keys=True),
+        _font_digest(text_font_path),
+        _font_digest(number_font_path),
+        fields,
+    )
+    cached = _layer_cache.get(key)
+    if cached is None:
+        cached = render_decoration(size, coords, fields, text_font_path, number_font_path)
+        _layer_cache.put(key, cached)
+    return cached
+
+def build_image_from_assets(row, asset_path, scale=1):
+    text_font_path = os.path.join(asset_path, 'text.otf')
+    number_font_path = os.path.join(asset_path, 'number.ttf')
+
+    image, coords, err = load_assets(asset_path, scale)
+    if err:
+        return None, err
+
+    layer, offset = decoration_layer(image.size, coords, row_text_fields(row), text_font_path, number_font_path)
+    if layer:
+        with stage("composite"):
+            image.alpha_composite(layer, offset)
 
     return image, None
 
+def clear_caches():
+    # Drops every in-process cache (blanks, templates, fonts, fits, glyphs,
+    # layers, file digests), e.g. to measure cold renders
+    _asset_cache.clear()
+    _glyph_cache.clear()
+    _layer_cache.clear()
+    clear_layout_caches()
+    _file_digest.cache_clear()
+    _open_template.cache_clear()
+
 def sanitize_filename(s):
     return "".join(c for c in s.replace(" ", "_") if c not in '/\\').strip("_")
 
@@ -393,6 +773,8 @@ def combo_key(art_type, player_name):
 
 def choose_input_csv():
     try:
+        # Imported here so headless runs never need tkinter
+        from tkinter import Tk, filedialog
         root = Tk()
         root.withdraw()
         root.update()
@@ -407,83 +789,1124 @@ def choose_input_csv():
         print(f"File dialog error: {e}")
         return ""
 
-def main():
-    # Reset output directory each run
-    if os.path.isdir(OUTPUT_DIR):
+@lru_cache(maxsize=256)
+def _file_digest(path, mtime_ns, size):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def asset_digest(asset_path):
+    # Content hash of everything in an asset folder that affects a render.
+    # Files are re-hashed only when their mtime or size changes.
+    template = load_template(asset_path)
+    digest = hashlib.sha256()
+    for name in ASSET_FILES:
+        if template is not None:
+            digest.update(f"{name}:{template['digests'][name]};".encode())
+            continue
+        path = os.path.join(asset_path, name)
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            digest.update(f"{name}:missing;".encode())
+            continue
+        digest.update(f"{name}:{_file_digest(path, st.st_mtime_ns, st.st_size)};".encode())
+    return digest.hexdigest()
+
+def render_inputs(job):
+    # Everything the encoded image depends on
+    return {
+        "renderer": RENDERER_VERSION,
+        "text": row_text_fields(job["row"]),
+        "save": job["save"],
+        "scale": job["scale"],
+        "assets": asset_digest(job["asset_path"]) if os.path.isdir(job["asset_path"]) else None,
+    }
+
+def hash_payload(payload):
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+def job_input_hash(job, inputs=None):
+    return hash_payload(dict(inputs or render_inputs(job), kind=job["kind"]))
+
+def render_cache_key(job, inputs=None):
+    # Unlike the manifest hash this leaves out the job kind, so a print file
+    # and a web image rendered identically share one entry
+    return hash_payload(inputs or render_inputs(job))
+
+def load_manifest(path=None):
+    try:
+        with open(path or MANIFEST_PATH, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+    return manifest.get("outputs", {})
+
+def write_manifest(outputs, path=None, **extra):
+    # extra: additional top-level entries (shard info in partial manifests)
+    path = path or MANIFEST_PATH
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(dict(extra, renderer=RENDERER_VERSION, outputs=outputs), f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+def shard_of(key, count):
+    # Stable across machines, runs and row order (unlike hash())
+    return int(hashlib.sha256(key.encode()).hexdigest()[:16], 16) % count
+
+def shard_manifest_path(shard):
+    index, count = shard
+    return os.path.join(SHARD_DIR, f"shard-{index}-of-{count}.json")
+
+def parse_shard_manifest_name(name):
+    # (index, count) for a shard-<i>-of-<N>.json file name, else None
+    if not (name.startswith('shard-') and name.endswith('.json')):
+        return None
+    index, sep, count = name[len('shard-'):-len('.json')].partition('-of-')
+    if not (sep and index.isdigit() and count.isdigit()):
+        return None
+    return int(index), int(count)
+
+def remove_other_shard_counts(count):
+    # Partial manifests from a run split into a different number of shards
+    # can never merge with this one, so a shard run clears them out
+    try:
+        names = os.listdir(SHARD_DIR)
+    except FileNotFoundError:
+        return
+    for name in sorted(names):
+        shard = parse_shard_manifest_name(name)
+        if shard and shard[1] != count:
+            path = os.path.join(SHARD_DIR, name)
+            try:
+                os.remove(path)
+                print(f"Removed stale shard manifest: {path}")
+            except OSError as e:
+                print(f"ERROR: Failed to remove stale shard manifest {path}: {e}")
+
+class HashedLines:
+    # Passes a CSV's lines through to csv.DictReader, hashing each one as it
+    # is read. The digest covers exactly the input this run rendered, stdin
+    # included, without reading the file a second time.
+    def __init__(self, lines):
+        self.lines = lines
+        self.digest = hashlib.sha256()
+
+    def __iter__(self):
+        for line in self.lines:
+            self.digest.update(line.encode('utf-8'))
+            yield line
+
+def shard_run_id(csv_digest, save_settings, web_scale):
+    # Identifies one sharded run: the CSV contents and every setting that
+    # shapes its outputs. All shards of a run must agree on it before they merge.
+    settings = {"renderer": RENDERER_VERSION, "save": save_settings, "web_scale": web_scale}
+    return hash_payload({"csv": csv_digest, "settings": settings})
+
+def output_key(path):
+    # Manifest keys are relative to OUTPUT_DIR with forward slashes
+    return os.path.relpath(path, OUTPUT_DIR).replace(os.sep, '/')
+
+def plan_jobs(rows, previous_outputs=None, save_settings=DEFAULT_SAVE_SETTINGS, web_scale=1, shard=None):
+    # Turns CSV rows into render jobs, in CSV order. Print-file ownership is
+    # decided here, before anything renders: the first row seen for each
+    # combo_key owns the print file, whether or not its render succeeds.
+    #
+    # shard: (index, count), 1-based. Only jobs owned by that shard are
+    # yielded. Web images belong to the shard their file name hashes to and
+    # print files to the shard their combo_key hashes to, so each output has
+    # exactly one owner whatever the row order. Every shard still reads every
+    # row, so all shards agree on which row owns each print file.
+    previous_outputs = previous_outputs or {}
+
+    def owned(key):
+        return shard is None or shard_of(key, shard[1]) == shard[0] - 1
+    web_save = save_settings['web']
+    print_save = save_settings['print']
+
+    def with_hashes(job):
+        inputs = render_inputs(job)
+        job["input_hash"] = job_input_hash(job, inputs)
+        job["cache_key"] = render_cache_key(job, inputs)
+        previous = previous_outputs.get(output_key(job["output_path"]))
+        job["previous_hash"] = previous["hash"] if previous else None
+        return job
+
+    processed_art_player = set()
+    for row_number, row in enumerate(rows, start=1):
+        art_type_val = (row.get('Art Type') or '').strip()
+        player_name = (row.get('Player Name') or '').strip()
+
+        # Normal per-row image
+        asset_folder = get_asset_folder(row)
+        # Main image filename: <Name>-1.png (no JPEG conversion)
+        product_id_s = (row.get('Name') or '').strip()
+        main_base = sanitize_filename(f"{product_id_s}-1")
+        main_ext = OUTPUT_FORMATS[web_save['format']]
+        if owned(f"web:{main_base}"):
+            yield with_hashes({
+                "kind": "web",
+                "row": row,
+                "row_number": row_number,
+                "asset_folder": asset_folder,
+                "asset_path": os.path.join(BIN_DIR, asset_folder),
+                "output_path": os.path.join(WEB_DIR, f"{main_base}{main_ext}"),
+                "save": web_save,
+                "scale": web_scale,
+            })
+
+        # One-per (Art Type + Player Name) print file
+        if art_type_val and player_name:
+            key = combo_key(art_type_val, player_name)
+            if key not in processed_art_player:
+                processed_art_player.add(key)
+                if not owned(f"print:{key[0]}|{key[1]}"):
+                    continue
+                # Print file filename: <Description>.png
+                desc = (row.get('Description') or '').strip()
+                extra_base = sanitize_filename(desc)
+                extra_ext = OUTPUT_FORMATS[print_save['format']]
+                yield with_hashes({
+                    "kind": "print",
+                    "row": row,
+                    "row_number": row_number,
+                    "art_type": art_type_val,
+                    "player_name": player_name,
+                    "asset_path": os.path.join(BIN_DIR, art_type_val),
+                    "output_path": os.path.join(PRINT_DIR, f"{extra_base}{extra_ext}"),
+                    "save": print_save,
+                    # Print files always render at the blank's full resolution
+                    "scale": 1,
+                })
+
+def encode_image(image, fp, save):
+    # fp: path or binary file object
+    if save['format'] == 'webp':
+        image.save(fp, format='WEBP', lossless=True, method=round(save['compress_level'] * 6 / 9))
+    else:
+        image.save(fp, format='PNG', compress_level=save['compress_level'])
+
+def save_image(image, output_path, save):
+    # Writes through a temp file so an interrupted run never leaves a
+    # truncated image behind under a name the manifest considers current
+    tmp_path = output_path + ".tmp"
+    encode_image(image, tmp_path, save)
+    os.replace(tmp_path, output_path)
+
+def render_cache_path(cache_dir, job):
+    return os.path.join(cache_dir, job["cache_key"][:2], job["cache_key"] + OUTPUT_FORMATS[job["save"]["format"]])
+
+def link_or_copy(src, dst):
+    # Hardlinks src at dst, copying where links are unsupported (e.g. across
+    # filesystems). Outputs are only ever replaced, never rewritten in place,
+    # so a cache entry and an output can safely share an inode.
+    tmp_path = f"{dst}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        os.link(src, tmp_path)
+    except OSError:
+        shutil.copyfile(src, tmp_path)
+    os.replace(tmp_path, dst)
+
+def restore_cached(cache_path, output_path):
+    # True if output_path now holds the cached image
+    try:
+        link_or_copy(cache_path, output_path)
+    except OSError:
+        return False
+    # The mtime is the recency that eviction goes by
+    with contextlib.suppress(OSError):
+        os.utime(cache_path)
+    return True
+
+def store_cached(output_path, cache_path):
+    # A cache that cannot be written only costs future renders
+    with contextlib.suppress(OSError):
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        link_or_copy(output_path, cache_path)
+
+def evict_render_cache(cache_dir, max_bytes):
+    # Deletes least recently used entries until the cache fits max_bytes.
+    # Returns (entries kept, bytes kept, entries evicted).
+    entries = []
+    for root, _, files in os.walk(cache_dir):
+        for name in files:
+            path = os.path.join(root, name)
+            with contextlib.suppress(OSError):
+                st = os.stat(path)
+                entries.append((st.st_mtime_ns, st.st_size, path))
+    total = sum(size for _, size, _ in entries)
+    evicted = 0
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        with contextlib.suppress(OSError):
+            os.remove(path)
+            total -= size
+            evicted += 1
+    return len(entries) - evicted, total, evicted
+
+def link_duplicate(first_path, output_path, writer=None):
+    # True if output_path now holds the image at first_path, an output of this
+    # run rendered from the same inputs. With a writer it may still be queued.
+    if writer and not writer.wait(first_path):
+        return False
+    try:
+        link_or_copy(first_path, output_path)
+    except OSError:
+        return False
+    return True
+
+def save_rendered(image, output_path, save, cache_path=None):
+    save_image(image, output_path, save)
+    if cache_path:
+        store_cached(output_path, cache_path)
+
+class ImageWriter:
+    # Encodes and writes images on a background thread so the next row renders
+    # while the previous one is compressed. The queue is bounded, so at most
+    # max_queued finished canvases wait in memory before rendering blocks.
+    def __init__(self, max_queued=WRITE_QUEUE_SIZE):
+        self.queue = queue.Queue(maxsize=max(1, max_queued))
+        self.failures = {}  # output path -> error message
+        self.encode_ms = {}  # output path -> encode + write time
+        self.written = {}  # output path -> Event set once its write finished or failed
+        self.thread = threading.Thread(target=self._run, name="image-writer", daemon=True)
+        self.thread.start()
+
+    def submit(self, image, output_path, save, cache_path=None):
+        self.written[output_path] = threading.Event()
+        self.queue.put((image, output_path, save, cache_path))
+
+    def wait(self, output_path):
+        # Blocks until a submitted output_path is written; False if that failed
+        event = self.written.get(output_path)
+        if event:
+            event.wait()
+        return output_path not in self.failures
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            image, output_path, save, cache_path = item
+            start = time.perf_counter()
+            try:
+                save_rendered(image, output_path, save, cache_path)
+            except Exception as e:
+                self.failures[output_path] = str(e)
+            self.encode_ms[output_path] = (time.perf_counter() - start) * 1000
+            self.written[output_path].set()
+
+    def close(self):
+        # Waits for queued writes and returns {output path: error} for failures
+        self.queue.put(None)
+        self.thread.join()
+        return self.failures
+
+def run_job(job, writer=None):
+    # Renders and saves one job unless its output is already up to date.
+    # Returns a result dict (log lines, combo record, manifest entry and, for
+    # jobs marked time_stages, a per-stage timing record) so the caller can
+    # report in CSV order whatever process ran the job. With a writer the
+    # image is handed off for encoding instead of saved inline.
+    if not job.get("time_stages"):
+        return _run_job(job, writer)
+    _stage_state.record = {}
+    start = time.perf_counter()
+    try:
+        result = _run_job(job, writer)
+    finally:
+        stages, _stage_state.record = _stage_state.record, None
+    result["timings"] = {
+        "output": output_key(job["output_path"]),
+        "kind": job["kind"],
+        "total_ms": round((time.perf_counter() - start) * 1000, 3),
+        "stages": stages,
+    }
+    return result
+
+def _run_job(job, writer):
+    asset_path = job["asset_path"]
+    output_path = job["output_path"]
+    result = {"lines": [], "combo": None, "output": None}
+    if job["kind"] == "print":
+        art_type_val = job["art_type"]
+        player_name = job["player_name"]
+        combo = {"art_type": art_type_val, "player_name": player_name, "path": output_path,
+                 "row_number": job.get("row_number")}
+
+    if not os.path.isdir(asset_path):
+        if job["kind"] == "web":
+            result["lines"].append(f"Skipping: asset folder missing {asset_path}")
+        else:
+            result["lines"].append(f"Combo assets missing for {art_type_val} at {asset_path}")
+        return result
+
+    up_to_date = job["previous_hash"] == job["input_hash"] and os.path.isfile(output_path)
+    cache_path = render_cache_path(job["render_cache"], job) if job.get("render_cache") else None
+    label = "style" if job["kind"] == "web" else "combo"
+    if up_to_date:
+        result["lines"].append(f"Unchanged {label}: {output_path}")
+    elif cache_path and os.path.isfile(cache_path) and restore_cached(cache_path, output_path):
+        result["lines"].append(f"Cached {label}: {output_path}")
+    elif job.get("duplicate_of") and link_duplicate(job["duplicate_of"], output_path, writer):
+        result["lines"].append(f"Cached {label}: {output_path}")
+    else:
+        image, err = build_image_from_assets(job["row"], asset_path, job["scale"])
+        if not image:
+            if job["kind"] == "web":
+                result["lines"].append(f"Skipping {job['asset_folder']}: {err}")
+            else:
+                result["lines"].append(f"Combo skip ({art_type_val}, {player_name}): {err}")
+            return result
+        if writer:
+            with stage("queue_wait"):
+                writer.submit(image, output_path, job["save"], cache_path)
+        else:
+            with stage("save"):
+                save_rendered(image, output_path, job["save"], cache_path)
+        result["lines"].append(f"Created {label}: {output_path}")
+
+    result["output"] = {"path": output_key(output_path), "hash": job["input_hash"], "kind": job["kind"]}
+    if job["kind"] == "print":
+        result["combo"] = combo
+    return result
+
+@lru_cache(maxsize=1024)
+def _asset_footprint(asset_path, blank_mtime_ns, coords_mtime_ns, scale):
+    # Peak bytes for rendering one image from this asset folder: decoded blank,
+    # its RGBA conversion and the working copy, the decoration strip, and
+    # coverage masks (plus dilation temporaries) for every field box.
+    with Image.open(os.path.join(asset_path, 'blank.png')) as blank:
+        width, height = blank.size  # header only, no decode
+    with open(os.path.join(asset_path, 'coords.json'), 'r', encoding='utf-8') as f:
+        coords = json.load(f)
+    if scale != 1:
+        width, height = max(1, round(width * scale)), max(1, round(height * scale))
+        coords = scale_coords(coords, scale)
+    top, bottom = decoration_rows(coords, height)
+    mask_bytes = 0
+    for field in coords.values():
+        if isinstance(field, dict) and 'coords' in field:
+            x1, y1, x2, y2 = field['coords']
+            pad = 2 * int(field.get('border_width', 0))
+            mask_bytes += 4 * max(0, x2 - x1 + pad) * max(0, y2 - y1 + pad)
+    return 3 * width * height * 4 + width * max(0, bottom - top) * 4 + mask_bytes
+
+def estimate_job_bytes(job):
+    # 0 when the job cannot render (missing folder or files); it only logs
+    asset_path = job["asset_path"]
+    try:
+        blank_mtime = os.stat(os.path.join(asset_path, 'blank.png')).st_mtime_ns
+        coords_mtime = os.stat(os.path.join(asset_path, 'coords.json')).st_mtime_ns
+        return _asset_footprint(asset_path, blank_mtime, coords_mtime, job["scale"])
+    except (OSError, ValueError):
+        return 0
+
+# Resident memory of a pool worker before it caches anything: the
+# interpreter, Pillow and loaded fonts (about 50 MB measured after a render)
+WORKER_BASELINE_BYTES = 64 * 1024 * 1024
+
+# Set in pool workers of a --profile run; enabled only while a job runs
+_worker_profiler = None
+
+def _init_worker(asset_cache_bytes, glyph_cache_bytes=None, layer_cache_bytes=None, profile_dir=None):
+    global _worker_profiler
+    if asset_cache_bytes is not None:
+        _asset_cache.max_bytes = asset_cache_bytes
+    if glyph_cache_bytes is not None:
+        _glyph_cache.max_bytes = glyph_cache_bytes
+    if layer_cache_bytes is not None:
+        _layer_cache.max_bytes = layer_cache_bytes
+    if profile_dir:
+        # Pool workers skip atexit, but multiprocessing runs its own
+        # finalizers when a worker exits at pool shutdown
+        _worker_profiler = cProfile.Profile()
+        multiprocessing.util.Finalize(None, _worker_profiler.dump_stats,
+                                      args=(os.path.join(profile_dir, f"worker-{os.getpid()}.pstats"),),
+                                      exitpriority=10)
+
+def _run_pooled_job(job):
+    if not _worker_profiler:
+        return run_job(job)
+    _worker_profiler.enable()
+    try:
+        return run_job(job)
+    finally:
+        _worker_profiler.disable()
+
+def pool_memory_plan(memory_budget, workers):
+    # Splits a memory budget (bytes) for a pool of workers. Each worker is
+    # charged WORKER_BASELINE_BYTES; half of what is left goes to the workers'
+    # blank, glyph and layer caches in the proportions of their default
+    # limits (never above them), and the rest is for jobs in flight.
+    # Returns ((asset, glyph, layer) cache bytes per worker, job budget), or
+    # None if the budget does not cover the workers' baselines.
+    available = memory_budget - workers * WORKER_BASELINE_BYTES
+    if available <= 0:
+        return None
+    defaults = (ASSET_CACHE_MAX_BYTES, GLYPH_CACHE_MAX_BYTES, LAYER_CACHE_MAX_BYTES)
+    per_worker = available // (2 * workers)
+    cache_bytes = tuple(min(limit, per_worker * limit // sum(defaults)) for limit in defaults)
+    return cache_bytes, available - sum(cache_bytes) * workers
+
+def run_jobs(jobs, workers=1, writer=None, memory_budget=None, profile_dir=None):
+    # Yields run_job results in job order. With more than one worker, jobs are
+    # spread over a process pool with a bounded number in flight so rows can
+    # stream in without queueing the whole CSV. Pool workers encode their own
+    # output, so the writer only applies to in-process rendering.
+    #
+    # memory_budget (bytes) caps the pool's estimated footprint, split by
+    # pool_memory_plan into worker baselines, per-worker cache limits and a
+    # job budget. Jobs are admitted only while the summed estimate of admitted
+    # jobs fits the job budget. A job that can never fit runs alone.
+    #
+    # With profile_dir, each pool worker profiles the jobs it runs and writes
+    # worker-<pid>.pstats there when the pool shuts down.
+    #
+    # With the render cache on, a job whose cache key matches an earlier job
+    # of this run waits for that job and links its output (duplicate_of)
+    # rather than rendering the same image again before the cache has it.
+    if workers <= 1:
+        first_outputs = {}  # cache key -> output path of its first successful job
+        for job in jobs:
+            key = job["cache_key"] if job.get("render_cache") else None
+            if key in first_outputs:
+                job["duplicate_of"] = first_outputs[key]
+            result = run_job(job, writer)
+            if key and key not in first_outputs and result["output"]:
+                first_outputs[key] = job["output_path"]
+            yield result
+        return
+
+    cache_bytes = (None, None, None)
+    job_budget = None
+    max_in_flight = workers * 2
+    if memory_budget:
+        cache_bytes, job_budget = pool_memory_plan(memory_budget, workers)
+        # Queued-but-not-started jobs count against the budget, so keep none
+        max_in_flight = workers
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=cache_bytes + (profile_dir,)) as pool:
+        pending = deque()  # (future, note, job, is a duplicate) in job order
+        # cache key -> (future, output path) of its first job. Once reported,
+        # the future is swapped for one holding only the manifest entry.
+        first_jobs = {}
+        admitted = {}  # future -> estimated bytes, until it finishes
+        in_flight_bytes = 0
+
+        def release(block):
+            nonlocal in_flight_bytes
+            if block:
+                wait(list(admitted), return_when=FIRST_COMPLETED)
+            for future in [f for f in admitted if f.done()]:
+                in_flight_bytes -= admitted.pop(future)
+
+        def ready_results():
+            while pending and pending[0][0].done():
+                future, note, job, duplicate = pending.popleft()
+                result = future.result()
+                key = job["cache_key"] if job.get("render_cache") else None
+                if duplicate:
+                    # Linking is cheap enough for this process. If the first
+                    # job produced nothing, the duplicate gets its own attempt
+                    # here, which normally just reports the same error.
+                    if result["output"]:
+                        job["duplicate_of"] = first_jobs[key][1]
+                    result = run_job(job)
+                elif key and first_jobs[key][0] is future:
+                    settled = Future()
+                    settled.set_result({"output": result["output"]})
+                    first_jobs[key] = (settled, job["output_path"])
+                if note:
+                    result["lines"].insert(0, note)
+                yield result
+
+        for job in jobs:
+            key = job["cache_key"] if job.get("render_cache") else None
+            if key in first_jobs:
+                pending.append((first_jobs[key][0], None, job, True))
+                yield from ready_results()
+                continue
+            estimate = estimate_job_bytes(job) if job_budget else 0
+            oversized = bool(job_budget) and estimate > job_budget
+            while admitted and (
+                len(admitted) >= max_in_flight
+                or oversized
+                or (job_budget and in_flight_bytes + estimate > job_budget)
+            ):
+                release(block=True)
+                yield from ready_results()
+            # Results are reported in order, so a slow head job holds back the
+            # rest; stop reading ahead once enough finished results are waiting.
+            while len(pending) >= max_in_flight * 4:
+                pending[0][0].result()
+                release(block=False)
+                yield from ready_results()
+
+            note = None
+            if oversized:
+                note = f"Memory: {job['output_path']} needs ~{estimate // 2**20} MB, over the budget; rendered alone"
+            future = pool.submit(_run_pooled_job, job)
+            admitted[future] = estimate
+            in_flight_bytes += estimate
+            pending.append((future, note, job, False))
+            if key:
+                first_jobs[key] = (future, job["output_path"])
+            release(block=False)
+            yield from ready_results()
+
+        while pending:
+            pending[0][0].result()
+            yield from ready_results()
+
+def remove_stale_outputs(previous_outputs, current_outputs):
+    # Deletes files the previous run produced that this run did not
+    for key in sorted(set(previous_outputs) - set(current_outputs)):
+        path = os.path.join(OUTPUT_DIR, *key.split('/'))
+        try:
+            os.remove(path)
+            print(f"Removed stale: {path}")
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"ERROR: Failed to remove stale output {path}: {e}")
+
+def write_stage_timings(path, records, encode_ms):
+    # One JSON line per job, then a run-level percentile summary line.
+    # Background encode times are known only once the writer has drained.
+    for record in records:
+        output_path = os.path.join(OUTPUT_DIR, *record["output"].split('/'))
+        if output_path in encode_ms:
+            record["stages"]["encode"] = dict({"ms": encode_ms[output_path], "calls": 1},
+                                              **dict.fromkeys(STAGE_COUNTERS, 0))
+        for entry in record["stages"].values():
+            entry["ms"] = round(entry["ms"], 3)
+    summary = summarize_stage_records(records)
+    with open(path, 'w', encoding='utf-8') as f:
+        for record in records:
+            f.write(json.dumps(dict(record, type="job")) + "\n")
+        f.write(json.dumps({"type": "summary", "jobs": len(records), "stages": summary}) + "\n")
+
+    print(f"\nStage timings ({len(records)} jobs) -> {path}")
+    for name, stats in sorted(summary.items(), key=lambda item: -item[1]["sum_ms"]):
+        images = ""
+        if "image_new" in stats:
+            images = f"  images {stats['image_new']:>6}  blocks {stats['image_blocks']:>6}"
+        print(f"  {name:<20} p50 {stats['p50_ms']:>9.1f} ms  p90 {stats['p90_ms']:>9.1f} ms  "
+              f"p99 {stats['p99_ms']:>9.1f} ms  total {stats['sum_ms'] / 1000:>8.2f} s{images}")
+
+def index_assets():
+    # {folder name: set of ASSET_FILES present} for every folder in bin/,
+    # from one directory scan per folder
+    index = {}
+    with os.scandir(BIN_DIR) as entries:
+        for entry in entries:
+            if entry.is_dir():
+                with os.scandir(entry.path) as files:
+                    present = {f.name for f in files if f.is_file()}
+                index[entry.name] = present.intersection(ASSET_FILES)
+    return index
+
+def format_rows(row_numbers, limit=5):
+    shown = ", ".join(str(n) for n in row_numbers[:limit])
+    more = len(row_numbers) - limit
+    return f"rows {shown}" + (f" and {more} more" if more > 0 else "")
+
+def preflight(jobs, index):
+    # Report lines for problems that would otherwise surface partway through a
+    # run: asset folders (row or print-file) that are missing or incomplete,
+    # and output names several rows map to, where later rows overwrite earlier
+    # ones. Returns (lines, problem count).
+    folder_rows = OrderedDict()  # asset folder -> [row numbers]
+    output_rows = OrderedDict()  # output path -> [row numbers]
+    for job in jobs:
+        folder_rows.setdefault(os.path.basename(job["asset_path"]), []).append(job["row_number"])
+        output_rows.setdefault(job["output_path"], []).append(job["row_number"])
+
+    problems = []
+    for folder, row_numbers in folder_rows.items():
+        if folder not in index:
+            problems.append(f"Missing asset folder: {folder} ({format_rows(row_numbers)})")
+            continue
+        missing = [name for name in ASSET_FILES if name not in index[folder]]
+        if missing:
+            problems.append(f"Incomplete asset folder: {folder} lacks {', '.join(missing)} ({format_rows(row_numbers)})")
+    for path, row_numbers in output_rows.items():
+        if len(row_numbers) > 1:
+            problems.append(f"Duplicate output name: {output_key(path)} ({format_rows(row_numbers)})")
+
+    rows = len({job["row_number"] for job in jobs})
+    lines = [f"Preflight: {len(jobs)} outputs from {rows} rows, {len(folder_rows)} asset folders"]
+    lines += [f"  {problem}" for problem in problems]
+    lines.append(f"Preflight: {len(problems)} problem(s)" if problems else "Preflight: OK")
+    return lines, len(problems)
+
+@lru_cache(maxsize=1024)
+def _blank_size(asset_path, blank_mtime_ns):
+    template = load_template(asset_path)
+    if template is not None:
+        return tuple(template["size"])
+    with Image.open(os.path.join(asset_path, 'blank.png')) as blank:
+        return blank.size  # header only, no decode
+
+def load_bench_profile(path):
+    # Render cost per output pixel from benchmark.py's clean batch run, for
+    # the whole batch and, where the benchmark recorded them, per kind with
+    # the save settings each kind was measured under. Returns (profile, err).
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            bench = json.load(f)
+    except FileNotFoundError:
+        return None, f"{path} not found; run benchmark.py first"
+    except ValueError as e:
+        return None, f"{path}: {e}"
+    batch = next((r for r in bench.get("results", []) if r.get("name") == "batch[clean]"), None)
+    if not batch or not batch.get("output_pixels"):
+        return None, f"{path} has no batch[clean] result with output_pixels; rerun benchmark.py"
+    batch_args = bench.get("params", {}).get("batch_args", [])
+    workers = 1
+    for i, arg in enumerate(batch_args):
+        if arg == '--workers' and i + 1 < len(batch_args):
+            workers = int(batch_args[i + 1])
+        elif arg.startswith('--workers='):
+            workers = int(arg.split('=', 1)[1])
+    profile = {
+        "seconds_per_pixel": batch["median_s"] / batch["output_pixels"],
+        "bytes_per_pixel": batch["output_bytes"] / batch["output_pixels"],
+        "workers": max(1, workers),
+        "commit": (bench.get("commit") or "unknown")[:10],
+        "batch_args": batch_args,
+        "kinds": {},
+    }
+    for kind, costs in batch.get("kinds", {}).items():
+        if costs.get("output_pixels"):
+            profile["kinds"][kind] = {
+                "seconds_per_pixel": costs["seconds"] / costs["output_pixels"],
+                "bytes_per_pixel": costs["output_bytes"] / costs["output_pixels"],
+                "save": costs.get("save"),
+            }
+    return profile, None
+
+def format_duration(seconds):
+    seconds = int(round(seconds))
+    if seconds < 60:
+        return f"{seconds}s"
+    minutes, seconds = divmod(seconds, 60)
+    if minutes < 60:
+        return f"{minutes}m {seconds:02d}s"
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h {minutes:02d}m"
+
+def format_save(settings):
+    return f"{settings['format']} level {settings['compress_level']}" if settings else "unknown settings"
+
+def dry_run_report(jobs, index, workers, bench_path, save_settings, cache_dir=None):
+    # What a run would do, with render time and output size scaled from the
+    # benchmark's cost per output pixel. Decoding, drawing and encoding all
+    # grow with pixel count, but web and print files are saved differently
+    # (PNG level 1 vs 9 by default), so each kind is priced from its own
+    # benchmark figures and flagged if the run saves it another way.
+    renderable = [
+        job for job in jobs
+        if index.get(os.path.basename(job["asset_path"]), set()).issuperset(ASSET_FILES)
+    ]
+    changed = [job for job in renderable if job["input_hash"] != job["previous_hash"]]
+    to_render = [
+        job for job in changed
+        if not (cache_dir and os.path.isfile(render_cache_path(cache_dir, job)))
+    ]
+    kinds = dict.fromkeys(('web', 'print'), 0)
+    kind_pixels = dict.fromkeys(('web', 'print'), 0)
+    for job in to_render:
+        blank_mtime = os.stat(os.path.join(job["asset_path"], 'blank.png')).st_mtime_ns
+        width, height = _blank_size(job["asset_path"], blank_mtime)
+        kinds[job["kind"]] += 1
+        kind_pixels[job["kind"]] += round(width * job["scale"]) * round(height * job["scale"])
+    pixels = sum(kind_pixels.values())
+
+    lines = [
+        f"Dry run: {len(to_render)} to render ({kinds['web']} web, {kinds['print']} print), "
+        f"{len(changed) - len(to_render)} cached, {len(renderable) - len(changed)} unchanged, "
+        f"{len(jobs) - len(renderable)} skipped; "
+        f"{pixels / 1e6:.1f} Mpx"
+    ]
+    profile, err = load_bench_profile(bench_path)
+    if err:
+        lines.append(f"No estimate: {err}")
+        return lines
+    seconds = 0.0
+    size = 0.0
+    for kind, kind_px in kind_pixels.items():
+        if not kind_px:
+            continue
+        costs = profile["kinds"].get(kind)
+        if not costs:
+            lines.append(f"WARNING: {bench_path} has no {kind} figures; estimating {kind} files "
+                         f"from the whole batch's average")
+            costs = profile
+        elif costs["save"] != save_settings[kind]:
+            lines.append(f"WARNING: {kind} files were benchmarked as {format_save(costs['save'])} "
+                         f"but this run saves {format_save(save_settings[kind])}; "
+                         f"their estimate may be far off")
+        seconds += kind_px * costs["seconds_per_pixel"]
+        size += kind_px * costs["bytes_per_pixel"]
+        lines.append(f"  {kind}: {kind_px / 1e6:.1f} Mpx, {kind_px * costs['bytes_per_pixel'] / 2**20:.1f} MB")
+    seconds *= profile["workers"] / max(1, workers)
+    lines.append(f"Estimated render time: {format_duration(seconds)} with {max(1, workers)} worker(s)")
+    lines.append(f"Estimated output size: {size / 2**20:.1f} MB")
+    lines.append(f"(profile: {bench_path}, commit {profile['commit']}, "
+                 f"batch args {' '.join(profile['batch_args']) or 'none'})")
+    return lines
+
+def write_profile(path, profiler, worker_dir=None):
+    # Dumps this process's profile, merged with the pool workers' dumps in
+    # worker_dir (which is removed), to path
+    stats = pstats.Stats(profiler)
+    worker_files = sorted(os.listdir(worker_dir)) if worker_dir else []
+    for name in worker_files:
+        stats.add(os.path.join(worker_dir, name))
+    stats.dump_stats(path)
+    if worker_dir:
+        shutil.rmtree(worker_dir, ignore_errors=True)
+        print(f"Wrote profile: {path} (this process and {len(worker_files)} pool worker(s))")
+    else:
+        print(f"Wrote profile: {path}")
+
+def open_input_csv(input_csv):
+    if input_csv == '-':
+        return contextlib.nullcontext(sys.stdin)
+    return open(input_csv, newline='', encoding='utf-8')
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Create NIL apparel images from a product CSV.",
+        epilog="Run 'generator.py compile' first to load asset folders from precompiled templates, "
+               "and 'generator.py merge' to combine --shard runs.")
+    parser.add_argument('input_csv', nargs='?',
+                        help="product CSV to render, or - to read it from stdin (default: pick with a file dialog)")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="number of render processes (default: 1, render in this process)")
+    parser.add_argument('--clean', action='store_true',
+                        help="clear the output directory and re-render everything")
+    for kind, label in (('web', 'web images'), ('print', 'print files')):
+        defaults = DEFAULT_SAVE_SETTINGS[kind]
+        parser.add_argument(f'--{kind}-format', choices=sorted(OUTPUT_FORMATS), default=defaults['format'],
+                            help=f"file format for {label} (default: {defaults['format']})")
+        parser.add_argument(f'--{kind}-compress-level', type=int, choices=range(10), metavar='0-9',
+                            default=defaults['compress_level'],
+                            help=f"compression effort for {label} (default: {defaults['compress_level']})")
+    parser.add_argument('--web-scale', type=float, default=1,
+                        help="render web images at this fraction of the blank's resolution, e.g. 0.25 (default: 1)")
+    parser.add_argument('--memory-budget', type=int, metavar='MB',
+                        help="cap the worker pool's estimated memory use: worker baselines, their caches and "
+                             "jobs in flight; large jobs run alone (default: no cap)")
+    parser.add_argument('--timings', metavar='JSONL',
+                        help="write per-row stage timings as JSON lines, ending with a percentile summary")
+    parser.add_argument('--profile', metavar='PSTATS',
+                        help="write a cProfile dump of the batch, merged across pool workers with --workers")
+    parser.add_argument('--render-cache', default=RENDER_CACHE_DIR, metavar='DIR',
+                        help="reuse finished images rendered from the same assets and text (default: render-cache)")
+    parser.add_argument('--render-cache-size', type=int, default=RENDER_CACHE_MAX_BYTES // 2**20, metavar='MB',
+                        help=f"evict least recently used cache entries beyond this size (default: {RENDER_CACHE_MAX_BYTES // 2**20})")
+    parser.add_argument('--no-render-cache', action='store_true',
+                        help="render everything, and do not read or fill the render cache")
+    parser.add_argument('--shard', type=parse_shard, metavar='i/N',
+                        help="render only shard i of N (1-based) and write a partial manifest for 'generator.py merge'")
+    parser.add_argument('--dry-run', action='store_true',
+                        help="check the CSV and assets, estimate render time and output size, and exit")
+    parser.add_argument('--bench-results', default=BENCH_RESULTS_PATH, metavar='JSON',
+                        help="benchmark.py results that --dry-run estimates from (default: bench_results.json)")
+    parser.add_argument('--skip-preflight', action='store_true',
+                        help="start rendering as rows arrive instead of checking the whole CSV first")
+    parser.add_argument('--write-queue', type=int, default=WRITE_QUEUE_SIZE,
+                        help=f"rendered images allowed to wait for the writer thread (default: {WRITE_QUEUE_SIZE})")
+    return parser.parse_args(argv)
+
+def compile_templates(argv):
+    parser = argparse.ArgumentParser(
+        prog='generator.py compile',
+        description=f"Validate asset folders in {BIN_DIR} and compile them into {TEMPLATE_DIR}.")
+    parser.add_argument('folders', nargs='*', help='asset folder names (default: every folder in bin)')
+    parser.add_argument('--force', action='store_true', help='recompile templates that are already current')
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(BIN_DIR):
+        print(f"ERROR: bin directory not found at {BIN_DIR}")
+        return
+    folders = args.folders or sorted(
+        name for name in os.listdir(BIN_DIR) if os.path.isdir(os.path.join(BIN_DIR, name)))
+    compiled = failed = 0
+    for folder in folders:
+        asset_path = os.path.join(BIN_DIR, folder)
+        if not args.force and load_template(asset_path) is not None:
+            print(f"Up to date: {folder}")
+            continue
+        err = compile_template(asset_path)
+        if err:
+            print(f"Skipping {folder}: {err}")
+            failed += 1
+        else:
+            print(f"Compiled template: {folder}")
+            compiled += 1
+    print(f"\nTemplates: {compiled} compiled, {failed} failed")
+
+def print_combo_summary(combos):
+    print(f"\nCombo summary (this run only): {len(combos)} created")
+    for c in combos:
+        print(f"- {c['art_type']} - {c['player_name']} -> {c['path']}")
+
+def merge_shards(argv):
+    parser = argparse.ArgumentParser(
+        prog='generator.py merge',
+        description=f"Combine --shard runs into {OUTPUT_DIR} with one manifest and combo summary.")
+    parser.add_argument('sources', nargs='*',
+                        help="shard output directories or partial manifest files (default: this output directory)")
+    parser.add_argument('--count', type=int, metavar='N',
+                        help="merge the N-way split and ignore partial manifests from any other shard count")
+    args = parser.parse_args(argv)
+
+    paths = []
+    for source in args.sources or [OUTPUT_DIR]:
+        if os.path.isdir(source):
+            shard_dir = os.path.join(source, 'shards')
+            if os.path.isdir(shard_dir):
+                paths += [os.path.join(shard_dir, name) for name in sorted(os.listdir(shard_dir))
+                          if parse_shard_manifest_name(name)]
+        else:
+            paths.append(source)
+
+    partials = {}
+    for path in paths:
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                partial = json.load(f)
+            index, count = partial["shard"]
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print(f"ERROR: Not a shard manifest {path}: {e}")
+            return
+        if args.count and count != args.count:
+            continue
+        if partial.get("renderer") != RENDERER_VERSION:
+            print(f"ERROR: {path} was written by renderer {partial.get('renderer')}, not {RENDERER_VERSION}")
+            return
+        if (index, count) in partials:
+            print(f"ERROR: Shard {index}/{count} found twice: {partials[(index, count)][0]} and {path}")
+            return
+        partials[(index, count)] = (path, partial)
+    if not partials:
+        print("ERROR: No shard manifests found")
+        return
+    counts = {count for _, count in partials}
+    if len(counts) != 1:
+        print(f"ERROR: Shard manifests from different shard counts: {sorted(counts)}; pass --count to pick one")
+        return
+    # Every shard must come from the same CSV and render settings
+    runs = {}
+    for (index, count), (path, partial) in sorted(partials.items()):
+        runs.setdefault(partial.get("run"), []).append(f"{index}/{count}")
+    if len(runs) != 1 or None in runs:
+        for run, shards in runs.items():
+            print(f"ERROR: Shards {', '.join(shards)} are from run {run[:12] if run else '(unrecorded)'}")
+        print("ERROR: Shard manifests come from different CSVs or render settings; re-run the stale shards")
+        return
+    count = counts.pop()
+    missing = [f"{i}/{count}" for i in range(1, count + 1) if (i, count) not in partials]
+    if missing:
+        print(f"ERROR: Missing shards: {', '.join(missing)}")
+        return
+
+    os.makedirs(WEB_DIR, exist_ok=True)
+    os.makedirs(PRINT_DIR, exist_ok=True)
+    merged = {}
+    owners = {}
+    combos = []
+    problems = 0
+    for (index, _), (path, partial) in sorted(partials.items()):
+        # Partial manifests live in <output dir>/shards/
+        source_dir = os.path.dirname(os.path.dirname(os.path.abspath(path)))
+        for key, entry in sorted(partial["outputs"].items()):
+            if key in merged:
+                print(f"ERROR: {key} produced by shards {owners[key]} and {index}; keeping shard {owners[key]}")
+                problems += 1
+                continue
+            src = os.path.join(source_dir, *key.split('/'))
+            dst = os.path.join(OUTPUT_DIR, *key.split('/'))
+            if os.path.abspath(src) != os.path.abspath(dst):
+                try:
+                    link_or_copy(src, dst)
+                except OSError as e:
+                    print(f"ERROR: Failed to collect {src}: {e}")
+                    problems += 1
+                    continue
+            elif not os.path.isfile(dst):
+                print(f"ERROR: Shard {index} output missing: {dst}")
+                problems += 1
+                continue
+            merged[key] = entry
+            owners[key] = index
+        for combo in partial.get("combos", []):
+            if combo["path"] in merged and owners[combo["path"]] == index:
+                combos.append(dict(combo, path=os.path.join(OUTPUT_DIR, *combo["path"].split('/'))))
+
+    remove_stale_outputs(load_manifest(), merged)
+    write_manifest(merged)
+    print(f"Merged {len(partials)} shards: {len(merged)} outputs, {problems} problem(s)")
+    combos.sort(key=lambda c: c.get("row_number") or 0)
+    print_combo_summary(combos)
+
+def parse_shard(text):
+    index, _, count = text.partition('/')
+    try:
+        index, count = int(index), int(count)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected i/N, got {text!r}")
+    if not 1 <= index <= count:
+        raise argparse.ArgumentTypeError(f"shard index must be in 1..{count}, got {index}")
+    return index, count
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    if argv[:1] == ['compile']:
+        return compile_templates(argv[1:])
+    if argv[:1] == ['merge']:
+        return merge_shards(argv[1:])
+    args = parse_args(argv)
+    if not 0 < args.web_scale <= 1:
+        print(f"ERROR: --web-scale must be in (0, 1], got {args.web_scale}")
+        return
+    if args.memory_budget and args.workers > 1 and not pool_memory_plan(args.memory_budget * 2**20, args.workers):
+        baseline_mb = args.workers * WORKER_BASELINE_BYTES // 2**20
+        print(f"ERROR: --memory-budget {args.memory_budget} MB does not cover {args.workers} workers "
+              f"({baseline_mb} MB before any caches or jobs)")
+        return
+
+    # Shards may share output/ with each other, so --clean only forces this
+    # shard to re-render and never clears the directory
+    if args.shard and args.clean:
+        print(f"Shard {args.shard[0]}/{args.shard[1]}: --clean re-renders this shard without clearing {OUTPUT_DIR}")
+
+    # A dry run leaves the output directory alone, --clean included
+    if args.clean and not args.shard and not args.dry_run and os.path.isdir(OUTPUT_DIR):
         try:
             shutil.rmtree(OUTPUT_DIR)
             print(f"Cleared output directory: {OUTPUT_DIR}")
         except Exception as e:
             print(f"ERROR: Failed to clear output directory {OUTPUT_DIR}: {e}")
             return
-    os.makedirs(WEB_DIR, exist_ok=True)
-    os.makedirs(PRINT_DIR, exist_ok=True)
+    if not args.dry_run:
+        os.makedirs(WEB_DIR, exist_ok=True)
+        os.makedirs(PRINT_DIR, exist_ok=True)
 
     if not os.path.isdir(BIN_DIR):
         print(f"ERROR: bin directory not found at {BIN_DIR}")
         return
 
-    input_csv = choose_input_csv()
+    input_csv = args.input_csv or choose_input_csv()
     if not input_csv:
         print("No input file selected. Exiting.")
         return
 
-    # Runtime-only registry of created combos
-    processed_art_player = set()
+    save_settings = {
+        'web': {'format': args.web_format, 'compress_level': args.web_compress_level},
+        'print': {'format': args.print_format, 'compress_level': args.print_compress_level},
+    }
+
+    # Outputs from the last run; anything this run does not reproduce is stale.
+    # A shard owns only what its partial manifest lists, but can still skip
+    # work a merged (or unsharded) run already did.
+    manifest_path = shard_manifest_path(args.shard) if args.shard else MANIFEST_PATH
+    previous_outputs = load_manifest(manifest_path)
+    known_outputs = dict(load_manifest(), **previous_outputs) if args.shard else previous_outputs
+    if args.clean:
+        known_outputs = {}
+
+    render_cache = None if args.no_render_cache else args.render_cache
+
+    # Preflight reads the whole CSV and checks every row against one scan of
+    # bin/ before anything renders
+    jobs = None
+    if args.dry_run or not args.skip_preflight:
+        with open_input_csv(input_csv) as csvfile:
+            csv_lines = HashedLines(csvfile)
+            rows = list(csv.DictReader(csv_lines))
+        jobs = list(plan_jobs(rows, known_outputs, save_settings, args.web_scale, args.shard))
+        index = index_assets()
+        lines, _ = preflight(jobs, index)
+        if args.dry_run:
+            lines += dry_run_report(jobs, index, args.workers, args.bench_results, save_settings, render_cache)
+        for line in lines:
+            print(line)
+        if args.dry_run:
+            return
+
+    current_outputs = {}
     combos_created = []
 
-    with open(input_csv, newline='', encoding='utf-8') as csvfile:
-        reader = csv.DictReader(csvfile)
-        for row in reader:
-            product_id = (row.get('Name') or '').strip()  # used only for per-row output filename
-            art_type_val = (row.get('Art Type') or '').strip()
-            player_name = (row.get('Player Name') or '').strip()
-
-            # Normal per-row image
-            asset_folder = get_asset_folder(row)
-            asset_path = os.path.join(BIN_DIR, asset_folder)
-            if os.path.isdir(asset_path):
-                image, err = build_image_from_assets(row, asset_path)
-                if image:
-                    # Main image filename: <Name>-1.png (no JPEG conversion)
-                    product_id_s = (row.get('Name') or '').strip()
-                    main_base = sanitize_filename(f"{product_id_s}-1")
-                    output_path = os.path.join(WEB_DIR, f"{main_base}.png")
-                    image.save(output_path)
-                    print(f"Created style: {output_path}")
-                else:
-                    print(f"Skipping {asset_folder}: {err}")
-            else:
-                print(f"Skipping: asset folder missing {asset_path}")
-
-            # One-per (Art Type + Player Name) print file, runtime only
-            if art_type_val and player_name:
-                key = combo_key(art_type_val, player_name)
-                if key not in processed_art_player:
-                    art_only_path = os.path.join(BIN_DIR, art_type_val)
-                    # Print file filename: <Description>.png
-                    desc = (row.get('Description') or '').strip()
-                    extra_base = sanitize_filename(desc)
-                    extra_out = os.path.join(PRINT_DIR, f"{extra_base}.png")
-
-                    if os.path.isdir(art_only_path):
-                        extra_image, err2 = build_image_from_assets(row, art_only_path)
-                        if extra_image:
-                            extra_image.save(extra_out)
-                            print(f"Created combo: {extra_out}")
-                            processed_art_player.add(key)
-                            combos_created.append({"art_type": art_type_val, "player_name": player_name, "path": extra_out})
-                        else:
-                            print(f"Combo skip ({art_type_val}, {player_name}): {err2}")
-                            processed_art_player.add(key)
-                    else:
-                        print(f"Combo assets missing for {art_type_val} at {art_only_path}")
-                        processed_art_player.add(key)
+    stage_records = []
+    profiler = cProfile.Profile() if args.profile else None
+    # Pool workers dump their own profiles here to be merged into args.profile
+    worker_profile_dir = tempfile.mkdtemp(prefix='profile-') if profiler and args.workers > 1 else None
+
+    writer = ImageWriter(args.write_queue) if args.workers <= 1 else None
+    if profiler:
+        profiler.enable()
+    try:
+        with contextlib.ExitStack() as stack:
+            if jobs is None:
+                csv_lines = HashedLines(stack.enter_context(open_input_csv(input_csv)))
+                reader = csv.DictReader(csv_lines)
+                jobs = plan_jobs(reader, known_outputs, save_settings, args.web_scale, args.shard)
+            if args.timings:
+                jobs = (dict(job, time_stages=True) for job in jobs)
+            if render_cache:
+                jobs = (dict(job, render_cache=render_cache) for job in jobs)
+            memory_budget = args.memory_budget * 2**20 if args.memory_budget else None
+            for result in run_jobs(jobs, args.workers, writer, memory_budget, worker_profile_dir):
+                for line in result["lines"]:
+                    print(line)
+                if result["output"]:
+                    current_outputs[result["output"]["path"]] = result["output"]
+                if result["combo"]:
+                    combos_created.append(result["combo"])
+                if result.get("timings"):
+                    stage_records.append(result["timings"])
+    finally:
+        write_failures = writer.close() if writer else {}
+        if profiler:
+            profiler.disable()
+            write_profile(args.profile, profiler, worker_profile_dir)
+
+    if args.timings:
+        write_stage_timings(args.timings, stage_records, writer.encode_ms if writer else {})
+
+    for path, err in write_failures.items():
+        print(f"ERROR: Failed to write {path}: {err}")
+        current_outputs.pop(output_key(path), None)
+    combos_created = [c for c in combos_created if c['path'] not in write_failures]
+
+    remove_stale_outputs(previous_outputs, current_outputs)
+    if args.shard:
+        combo_records = [dict(c, path=output_key(c['path'])) for c in combos_created]
+        run_id = shard_run_id(csv_lines.digest.hexdigest(), save_settings, args.web_scale)
+        write_manifest(current_outputs, manifest_path, shard=list(args.shard), combos=combo_records, run=run_id)
+        remove_other_shard_counts(args.shard[1])
+    else:
+        write_manifest(current_outputs)
+    if render_cache and os.path.isdir(render_cache):
+        entries, size, evicted = evict_render_cache(render_cache, args.render_cache_size * 2**20)
+        print(f"Render cache: {entries} entries, {size / 2**20:.1f} MB ({evicted} evicted)")
 
     # Optional summary
-    print(f"\nCombo summary (this run only): {len(combos_created)} created")
-    for c in combos_created:
-        print(f"- {c['art_type']} - {c['player_name']} -> {c['path']}")
+    print_combo_summary(combos_created)
+    if args.shard:
+        print(f"Shard {args.shard[0]}/{args.shard[1]} manifest: {manifest_path}; run 'generator.py merge' once every shard is done")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,289 @@
+#local HTTP preview service for the apparel image generator
+#keeps blanks, fonts and layers warm in a pool of render processes so a preview costs one render
+#
+#  python render_service.py --port 8765 --workers 2 --scale 0.25
+#  curl -o preview.png 'http://127.0.0.1:8765/render?Team=...&Color+List=...&Art+Type=...&Class=...&Last+Name=HOWARD'
+#  curl -o preview.png -d '{"folder": "...", "Last Name": "HOWARD", "Jersey Number": "18"}' http://127.0.0.1:8765/render
+#
+#Request fields are the CSV columns. "folder" names the bin/ asset folder directly; without it the
+#folder comes from Team, Color List, Art Type and Class like a CSV row. "scale" and "format"
+#override the service defaults per request.
+
+import argparse
+import io
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from functools import partial
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+import generator
+
+# Requests for the same folder and output settings that arrive within this
+# window of the first one are dispatched together as one batch
+BATCH_WINDOW_MS = 10
+BATCH_MAX_SIZE = 8
+CONTENT_TYPES = {'png': 'image/png', 'webp': 'image/webp'}
+# Longest a request waits for its render before answering 504
+RENDER_TIMEOUT_S = 120
+
+def _init_worker(asset_cache_bytes, warm_folders, scale):
+    generator._init_worker(asset_cache_bytes)
+    for folder in warm_folders:
+        generator.load_assets(os.path.join(generator.BIN_DIR, folder), scale)
+
+def worker_pid():
+    return os.getpid()
+
+def render_batch(folder, rows, scale, save):
+    # Runs in a pool worker. Returns [(body, err, render start as wall-clock
+    # time, render + encode ms)] in row order; the blank is loaded once for
+    # the whole batch and stays cached for later ones.
+    asset_path = os.path.join(generator.BIN_DIR, folder)
+    results = []
+    for row in rows:
+        started = time.time()
+        start = time.perf_counter()
+        image, err = generator.build_image_from_assets(row, asset_path, scale)
+        body = None
+        if image:
+            buffer = io.BytesIO()
+            generator.encode_image(image, buffer, save)
+            body = buffer.getvalue()
+        results.append((body, err, started, (time.perf_counter() - start) * 1000))
+    return results
+
+class Batcher:
+    # Collects requests per (folder, scale, save settings) and hands each
+    # group to the pool once its window closes or it reaches max_size.
+    # Identical rows in a group render once and share the result, and the
+    # distinct rows are split over up to `workers` pool tasks so a batch never
+    # renders serially on one worker while the others sit idle.
+    def __init__(self, pool, workers=1, window_ms=BATCH_WINDOW_MS, max_size=BATCH_MAX_SIZE):
+        self.pool = pool
+        self.workers = max(1, workers)
+        self.window = window_ms / 1000
+        self.max_size = max(1, max_size)
+        self.groups = OrderedDict()  # key -> {"deadline", "items"}
+        self.cond = threading.Condition()
+        self.closed = False
+        self.thread = threading.Thread(target=self._run, name="batcher", daemon=True)
+        self.thread.start()
+
+    def submit(self, folder, row, scale, save):
+        # Returns a Future for {"body", "err", "queue_ms", "render_ms", "batch_size"}
+        item = {"row": row, "arrived": time.time(), "future": Future()}
+        key = (folder, scale, json.dumps(save, sort_keys=True))
+        with self.cond:
+            group = self.groups.get(key)
+            if group is None:
+                group = self.groups[key] = {"deadline": time.perf_counter() + self.window, "items": []}
+            group["items"].append(item)
+            if len(group["items"]) >= self.max_size:
+                self._dispatch(key)
+            self.cond.notify()
+        return item["future"]
+
+    def _dispatch(self, key):
+        folder, scale, save = key
+        items = self.groups.pop(key)["items"]
+        by_row = OrderedDict()  # row -> items asking for it
+        for item in items:
+            by_row.setdefault(json.dumps(item["row"], sort_keys=True), []).append(item)
+        waiting = list(by_row.values())
+        tasks = min(self.workers, len(waiting))
+        for i in range(tasks):
+            share = waiting[i::tasks]
+            task = self.pool.submit(render_batch, folder, [group[0]["row"] for group in share], scale,
+                                    json.loads(save))
+            task.add_done_callback(partial(self._deliver, share, len(items)))
+
+    def _deliver(self, share, batch_size, task):
+        # share: [[items with one row]] in the order their rows were rendered
+        try:
+            results = task.result()
+        except Exception as e:
+            for group in share:
+                for item in group:
+                    item["future"].set_exception(e)
+            return
+        for group, (body, err, started, render_ms) in zip(share, results):
+            for item in group:
+                item["future"].set_result({
+                    "body": body,
+                    "err": err,
+                    "queue_ms": max(0.0, (started - item["arrived"]) * 1000),
+                    "render_ms": render_ms,
+                    "batch_size": batch_size,
+                })
+
+    def _run(self):
+        with self.cond:
+            while not self.closed:
+                now = time.perf_counter()
+                for key in [k for k, g in self.groups.items() if g["deadline"] <= now]:
+                    self._dispatch(key)
+                deadline = min((g["deadline"] for g in self.groups.values()), default=None)
+                self.cond.wait(None if deadline is None else max(0.0, deadline - now))
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            for key in list(self.groups):
+                self._dispatch(key)
+            self.cond.notify()
+        self.thread.join()
+
+class RenderHandler(BaseHTTPRequestHandler):
+    server_version = "ApparelRender/1"
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path == '/health':
+            self.send_json(200, {"status": "ok", "workers": self.server.workers})
+        elif url.path == '/render':
+            self.render(dict(parse_qsl(url.query)))
+        else:
+            self.send_json(404, {"error": f"no such endpoint: {url.path}"})
+
+    def do_POST(self):
+        if urlsplit(self.path).path != '/render':
+            self.send_json(404, {"error": f"no such endpoint: {self.path}"})
+            return
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+            params = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError as e:
+            self.send_json(400, {"error": f"request body is not JSON: {e}"})
+            return
+        if not isinstance(params, dict):
+            self.send_json(400, {"error": "request body must be a JSON object"})
+            return
+        self.render(params)
+
+    def render(self, params):
+        received = time.perf_counter()
+        params = {k: str(v) for k, v in params.items()}
+        try:
+            folder = params.pop('folder', None) or generator.get_asset_folder(params)
+        except KeyError as e:
+            self.send_json(400, {"error": f"need 'folder' or the CSV column {e}"})
+            return
+        if folder in ('.', '..') or os.sep in folder or (os.altsep and os.altsep in folder):
+            self.send_json(400, {"error": f"bad asset folder: {folder}"})
+            return
+        if not os.path.isdir(os.path.join(generator.BIN_DIR, folder)):
+            self.send_json(404, {"error": f"asset folder missing: {folder}"})
+            return
+        try:
+            scale = float(params.pop('scale', self.server.scale))
+        except ValueError:
+            scale = 0
+        if not 0 < scale <= 1:
+            self.send_json(400, {"error": "scale must be in (0, 1]"})
+            return
+        save = dict(self.server.save, format=params.pop('format', self.server.save['format']))
+        if save['format'] not in CONTENT_TYPES:
+            self.send_json(400, {"error": f"format must be one of {', '.join(CONTENT_TYPES)}"})
+            return
+
+        future = self.server.batcher.submit(folder, params, scale, save)
+        try:
+            result = future.result(timeout=RENDER_TIMEOUT_S)
+        except TimeoutError:
+            self.send_json(504, {"error": "render timed out"})
+            return
+        except Exception as e:
+            self.send_json(500, {"error": f"render failed: {e}"})
+            return
+        if result["err"]:
+            self.send_json(422, {"error": f"{folder}: {result['err']}"})
+            return
+
+        total_ms = (time.perf_counter() - received) * 1000
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPES[save['format']])
+        self.send_header('Content-Length', str(len(result["body"])))
+        self.send_header('X-Queue-Ms', f"{result['queue_ms']:.1f}")
+        self.send_header('X-Render-Ms', f"{result['render_ms']:.1f}")
+        self.send_header('X-Total-Ms', f"{total_ms:.1f}")
+        self.send_header('X-Batch-Size', str(result["batch_size"]))
+        self.send_header('Server-Timing',
+                         f"queue;dur={result['queue_ms']:.1f}, render;dur={result['render_ms']:.1f}, "
+                         f"total;dur={total_ms:.1f}")
+        self.end_headers()
+        self.wfile.write(result["body"])
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Serve apparel image previews over HTTP on localhost.")
+    parser.add_argument('--host', default='127.0.0.1', help="address to bind (default: 127.0.0.1)")
+    parser.add_argument('--port', type=int, default=8765, help="port to bind, 0 for any free port (default: 8765)")
+    parser.add_argument('--workers', type=int, default=2, help="render processes (default: 2)")
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help="default output scale, like generator.py --web-scale (default: 1)")
+    parser.add_argument('--format', choices=sorted(generator.OUTPUT_FORMATS),
+                        default=generator.DEFAULT_SAVE_SETTINGS['web']['format'],
+                        help="default image format (default: %(default)s)")
+    parser.add_argument('--compress-level', type=int, choices=range(10), metavar='0-9',
+                        default=generator.DEFAULT_SAVE_SETTINGS['web']['compress_level'],
+                        help="encoder effort, as in generator.py (default: %(default)s)")
+    parser.add_argument('--batch-window', type=float, default=BATCH_WINDOW_MS, metavar='MS',
+                        help=f"how long to collect same-folder requests into one batch; identical requests "
+                             f"in a batch share one render (default: {BATCH_WINDOW_MS})")
+    parser.add_argument('--batch-size', type=int, default=BATCH_MAX_SIZE,
+                        help=f"largest batch (default: {BATCH_MAX_SIZE})")
+    parser.add_argument('--asset-cache', type=int, metavar='MB',
+                        help="decoded blanks each worker keeps warm (default: generator's limit)")
+    parser.add_argument('--warm', action='append', default=[], metavar='FOLDER',
+                        help="asset folder to load into every worker at startup (repeatable)")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    if not 0 < args.scale <= 1:
+        print(f"ERROR: --scale must be in (0, 1], got {args.scale}")
+        return
+    if not os.path.isdir(generator.BIN_DIR):
+        print(f"ERROR: bin directory not found at {generator.BIN_DIR}")
+        return
+
+    workers = max(1, args.workers)
+    asset_cache_bytes = args.asset_cache * 2**20 if args.asset_cache else None
+    pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                               initargs=(asset_cache_bytes, args.warm, args.scale))
+    # Start every worker (and run its warm-up) before taking requests, so the
+    # first previews do not pay for process start and asset decoding
+    for task in [pool.submit(worker_pid) for _ in range(workers)]:
+        task.result()
+    server = ThreadingHTTPServer((args.host, args.port), RenderHandler)
+    server.daemon_threads = True
+    server.workers = workers
+    server.scale = args.scale
+    server.save = {'format': args.format, 'compress_level': args.compress_level}
+    server.batcher = Batcher(pool, workers, args.batch_window, args.batch_size)
+
+    host, port = server.server_address[:2]
+    print(f"Serving previews on http://{host}:{port}/render ({workers} workers)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.batcher.close()
+        pool.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+# Borders come from dilate_mask + composite_field instead of redrawing the
+# text at every offset within the border width. These tests render a bordered
+# field both ways on a real garment asset, over an opaque part of its blank
+# and over its fully transparent corner, and pin how far the two may differ.
+
+import json
+import os
+import sys
+
+import pytest
+from PIL import Image, ImageChops, ImageDraw
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import generator
+from text_layout import layout_block, layout_stretched, load_font
+
+ASSET = os.path.join(ROOT, 'bin', 'NCAA-OHIO ST BUCKEYES-GRAPHITE-STACKED BOX NEUTRAL-CREW')
+BORDER_WIDTHS = [1, 3, 6]
+BORDER_COLOR = '#ffffff'
+SPORT_TEXT = "WOMEN'S VOLLEYBALL"
+# Largest per-channel difference allowed on pixels both renders leave opaque
+NUMBER_RGB_TOLERANCE = 10
+GLYPH_RUN_RGB_TOLERANCE = 20
+# Largest alpha difference allowed anywhere
+NUMBER_ALPHA_TOLERANCE = 3
+GLYPH_RUN_ALPHA_TOLERANCE = 16
+
+pytestmark = pytest.mark.skipif(not os.path.isdir(ASSET), reason="bordered test asset missing from bin/")
+
+@pytest.fixture(scope="module")
+def asset():
+    blank = Image.open(os.path.join(ASSET, 'blank.png')).convert('RGBA')
+    with open(os.path.join(ASSET, 'coords.json'), 'r', encoding='utf-8') as f:
+        coords, err = generator.normalize_coords(json.load(f))
+    assert not err
+    return blank, coords
+
+def bordered_canvases(asset, field, border_width):
+    # (field coords relative to the canvas, {background: canvas}) with the
+    # field's border switched on and room around the box for it to grow into
+    blank, coords = asset
+    pad = border_width + 4
+    x1, y1, x2, y2 = coords[field]['coords']
+    size = (x2 - x1 + 2 * pad, y2 - y1 + 2 * pad)
+    field_coords = dict(coords[field], coords=[pad, pad, pad + x2 - x1, pad + y2 - y1],
+                        border=True, border_width=border_width, border_color=BORDER_COLOR)
+    opaque = blank.crop((x1 - pad, y1 - pad, x2 + pad, y2 + pad))
+    clear = blank.crop((0, 0) + size)
+    assert opaque.getchannel('A').getextrema() == (255, 255)
+    assert clear.getchannel('A').getextrema() == (0, 0)
+    return field_coords, {'opaque': opaque, 'clear': clear}
+
+def differences(old, new):
+    # (largest alpha difference, largest RGB difference where both are opaque)
+    alpha = ImageChops.difference(old.getchannel('A'), new.getchannel('A')).getextrema()[1]
+    opaque = ImageChops.darker(old.getchannel('A'), new.getchannel('A')).point(lambda v: 255 if v == 255 else 0)
+    rgb = ImageChops.difference(old.convert('RGB'), new.convert('RGB'))
+    return alpha, max(ImageChops.darker(channel, opaque).getextrema()[1] for channel in rgb.split())
+
+def offset_loop_number(image, coords, number, font_path):
+    # The number outline as it was drawn before dilate_mask
+    draw = ImageDraw.Draw(image)
+    x1, y1, x2, y2 = coords['coords']
+    border_width = coords['border_width']
+    layout = layout_block(font_path, number, y2 - y1)
+    text_x = x1 + (x2 - x1 - layout.width) // 2
+    text_y = y1 + (y2 - y1 - layout.height) // 2
+    for dx in range(-border_width, border_width + 1):
+        for dy in range(-border_width, border_width + 1):
+            if dx == 0 and dy == 0:
+                continue
+            draw.text((text_x + dx, text_y + dy), number, font=layout.font, fill=coords['border_color'])
+    draw.text((text_x, text_y), number, font=layout.font, fill=coords['color'])
+
+def offset_loop_sport(image, coords, sport_text, font_path, rgba_glyphs):
+    # The sport outline as an offset loop over the same layout. rgba_glyphs
+    # pastes coloured RGBA glyphs through their own alpha, as the renderer did
+    # before dilate_mask; otherwise each colour goes through render_sport's
+    # glyph masks, which isolates the border from the glyph rasterisation.
+    x1, y1, x2, y2 = coords['coords']
+    border_width = coords['border_width']
+    layout = layout_stretched(font_path, sport_text, x2 - x1, y2 - y1, coords['spacing_factor'],
+                              max_stretch=2.4, justify=True)
+    text_x = int(x1 + (x2 - x1 - layout.width) // 2)
+    passes = [(dx, dy, coords['border_color'])
+              for dx in range(-border_width, border_width + 1)
+              for dy in range(-border_width, border_width + 1)
+              if dx or dy]
+    passes.append((0, 0, coords['color']))
+    for dx, dy, fill in passes:
+        for char, char_width, glyph_width, offset in zip(sport_text, layout.char_widths,
+                                                         layout.glyph_widths, layout.offsets):
+            position = (text_x + offset + dx, y1 + dy)
+            if rgba_glyphs:
+                glyph = Image.new('RGBA', (char_width * 2, layout.font_size * 2), (0, 0, 0, 0))
+                ImageDraw.Draw(glyph).text((0, 0), char, font=load_font(font_path, layout.font_size), fill=fill)
+                if glyph.getbbox():
+                    glyph = glyph.crop(glyph.getbbox())
+                glyph = glyph.resize((glyph_width, layout.height), Image.LANCZOS)
+                image.paste(glyph, position, glyph)
+            else:
+                mask = generator.render_stretched_glyph(font_path, layout.font_size, char, char_width,
+                                                        glyph_width, layout.height)
+                image.paste(fill, position, mask)
+
+@pytest.mark.parametrize("border_width", BORDER_WIDTHS)
+@pytest.mark.parametrize("number", ["18", "7"])
+def test_number_border_matches_offset_loop(asset, border_width, number):
+    font_path = os.path.join(ASSET, 'number.ttf')
+    coords, backgrounds = bordered_canvases(asset, 'Number', border_width)
+    for background, canvas in backgrounds.items():
+        old, new = canvas.copy(), canvas.copy()
+        offset_loop_number(old, coords, number, font_path)
+        generator.number_render(new, coords, number, font_path)
+        alpha, rgb = differences(old, new)
+        assert rgb <= NUMBER_RGB_TOLERANCE, background
+        assert alpha <= NUMBER_ALPHA_TOLERANCE, background
+
+@pytest.mark.parametrize("border_width", BORDER_WIDTHS)
+def test_glyph_run_border_matches_offset_loop(asset, border_width):
+    font_path = os.path.join(ASSET, 'text.otf')
+    coords, backgrounds = bordered_canvases(asset, 'Sport', border_width)
+    for background, canvas in backgrounds.items():
+        old, new = canvas.copy(), canvas.copy()
+        offset_loop_sport(old, coords, SPORT_TEXT, font_path, rgba_glyphs=False)
+        generator.render_sport(new, coords, SPORT_TEXT, font_path)
+        alpha, rgb = differences(old, new)
+        assert rgb <= GLYPH_RUN_RGB_TOLERANCE, background
+        assert alpha <= GLYPH_RUN_ALPHA_TOLERANCE, background
+
+@pytest.mark.parametrize("border_width", BORDER_WIDTHS)
+def test_glyph_run_border_no_longer_cuts_alpha(asset, border_width):
+    # Intended output change: pasting RGBA glyphs through their own alpha
+    # replaced the blank's alpha at every antialiased border edge, cutting
+    # holes into opaque blanks. The composited border only ever adds coverage.
+    font_path = os.path.join(ASSET, 'text.otf')
+    coords, backgrounds = bordered_canvases(asset, 'Sport', border_width)
+    for background, canvas in backgrounds.items():
+        old, new = canvas.copy(), canvas.copy()
+        offset_loop_sport(old, coords, SPORT_TEXT, font_path, rgba_glyphs=True)
+        generator.render_sport(new, coords, SPORT_TEXT, font_path)
+        assert ImageChops.subtract(old.getchannel('A'), new.getchannel('A')).getextrema()[1] == 0, background
+        if background == 'opaque':
+            assert old.getchannel('A').getextrema()[0] < 255
+            assert new.getchannel('A').getextrema() == (255, 255)
@@ -0,0 +1,77 @@
+# --dry-run estimates from a benchmark profile written in a scratch directory:
+# web and print files are priced separately, and a run that saves a kind with
+# other settings than the benchmark did is warned about.
+
+import csv
+import io
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FOLDER = 'NCAA-OHIO ST BUCKEYES-GRAPHITE-STACKED BOX NEUTRAL-CREW'
+COLUMNS = ['Name', 'Team', 'Color List', 'Art Type', 'Class', 'First Name', 'Last Name', 'Jersey Number',
+           'Jersey Characters', 'Sport Specific', 'Player Name', 'Description']
+BYTES_PER_PIXEL = {'web': 0.5, 'print': 0.01}
+
+pytestmark = pytest.mark.skipif(not os.path.isdir(os.path.join(ROOT, 'bin', FOLDER)),
+                                reason="test asset missing from bin/")
+
+def bench_results(kinds):
+    batch = {"name": "batch[clean]", "median_s": 10.0, "output_pixels": 2 * 10**6, "output_bytes": 10**6,
+             "kinds": {}}
+    for kind, level in kinds.items():
+        batch["kinds"][kind] = {"outputs": 1, "output_pixels": 10**6, "output_bytes": BYTES_PER_PIXEL[kind] * 10**6,
+                                "seconds": 5.0, "save": {"format": "png", "compress_level": level}}
+    return {"commit": "abc", "params": {"batch_args": []}, "results": [batch]}
+
+@pytest.fixture
+def workdir(tmp_path):
+    for name in os.listdir(ROOT):
+        if name.endswith('.py'):
+            shutil.copy(os.path.join(ROOT, name), tmp_path)
+    os.symlink(os.path.join(ROOT, 'bin'), tmp_path / 'bin')
+    out = io.StringIO()
+    writer = csv.DictWriter(out, fieldnames=COLUMNS)
+    writer.writeheader()
+    writer.writerow({
+        'Name': 'P-1', 'Team': 'NCAA-OHIO ST BUCKEYES', 'Color List': 'GRAPHITE',
+        'Art Type': 'STACKED BOX NEUTRAL', 'Class': 'Apparel: Tops: CREW', 'First Name': 'Will',
+        'Last Name': 'HOWARD', 'Jersey Number': '18', 'Jersey Characters': '', 'Sport Specific': 'Football',
+        'Player Name': 'Will Howard', 'Description': '',
+    })
+    (tmp_path / 'input.csv').write_text(out.getvalue(), encoding='utf-8')
+    return tmp_path
+
+def dry_run(workdir, kinds, *args):
+    with open(workdir / 'bench_results.json', 'w', encoding='utf-8') as f:
+        json.dump(bench_results(kinds), f)
+    result = subprocess.run([sys.executable, 'generator.py', 'input.csv', '--dry-run', '--no-render-cache', *args],
+                            cwd=workdir, capture_output=True, text=True, timeout=300)
+    assert result.returncode == 0, result.stderr
+    return result.stdout
+
+def test_kinds_priced_separately(workdir):
+    out = dry_run(workdir, {'web': 1, 'print': 9})
+    assert "WARNING" not in out
+    total_mb = 0.0
+    for kind, bytes_per_pixel in BYTES_PER_PIXEL.items():
+        mpx, mb = map(float, re.search(rf"^  {kind}: ([\d.]+) Mpx, ([\d.]+) MB$", out, re.M).groups())
+        assert mb == pytest.approx(mpx * 1e6 * bytes_per_pixel / 2**20, abs=0.1)
+        total_mb += mb
+    estimate = float(re.search(r"Estimated output size: ([\d.]+) MB", out).group(1))
+    assert estimate == pytest.approx(total_mb, abs=0.1)
+
+def test_warns_about_other_save_settings(workdir):
+    out = dry_run(workdir, {'web': 1, 'print': 9}, '--print-compress-level', '1')
+    assert "WARNING: print files were benchmarked as png level 9 but this run saves png level 1" in out
+    assert "WARNING: web" not in out
+
+def test_warns_about_missing_kind(workdir):
+    out = dry_run(workdir, {'web': 1})
+    assert "has no print figures" in out
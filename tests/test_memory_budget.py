@@ -0,0 +1,36 @@
+# How --memory-budget is split between pool workers' baselines, their caches
+# and the jobs in flight.
+
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import generator
+
+MB = 2**20
+
+def test_plan_charges_baselines_and_caches():
+    for budget_mb, workers in [(256, 2), (2048, 2), (512, 4), (65536, 8)]:
+        budget = budget_mb * MB
+        (asset, glyph, layer), job_budget = generator.pool_memory_plan(budget, workers)
+        assert job_budget > 0
+        assert workers * (generator.WORKER_BASELINE_BYTES + asset + glyph + layer) + job_budget == budget
+        assert asset <= generator.ASSET_CACHE_MAX_BYTES
+        assert glyph <= generator.GLYPH_CACHE_MAX_BYTES
+        assert layer <= generator.LAYER_CACHE_MAX_BYTES
+
+def test_plan_rejects_budget_below_baselines():
+    assert generator.pool_memory_plan(2 * generator.WORKER_BASELINE_BYTES, 2) is None
+
+def test_worker_cache_limits_follow_plan():
+    caches = (generator._asset_cache, generator._glyph_cache, generator._layer_cache)
+    defaults = [cache.max_bytes for cache in caches]
+    cache_bytes, _ = generator.pool_memory_plan(512 * MB, 4)
+    try:
+        generator._init_worker(*cache_bytes)
+        assert tuple(cache.max_bytes for cache in caches) == cache_bytes
+    finally:
+        for cache, limit in zip(caches, defaults):
+            cache.max_bytes = limit
@@ -0,0 +1,50 @@
+# --profile with a process pool: each worker profiles its own jobs and the
+# dumps are merged with this process's into one pstats file.
+
+import csv
+import io
+import os
+import pstats
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FOLDER = 'NCAA-OHIO ST BUCKEYES-GRAPHITE-STACKED BOX NEUTRAL-CREW'
+COLUMNS = ['Name', 'Team', 'Color List', 'Art Type', 'Class', 'First Name', 'Last Name', 'Jersey Number',
+           'Jersey Characters', 'Sport Specific', 'Player Name', 'Description']
+
+pytestmark = pytest.mark.skipif(not os.path.isdir(os.path.join(ROOT, 'bin', FOLDER)),
+                                reason="test asset missing from bin/")
+
+@pytest.fixture
+def workdir(tmp_path):
+    for name in os.listdir(ROOT):
+        if name.endswith('.py'):
+            shutil.copy(os.path.join(ROOT, name), tmp_path)
+    os.symlink(os.path.join(ROOT, 'bin'), tmp_path / 'bin')
+    return tmp_path
+
+def test_profile_covers_pool_workers(workdir):
+    out = io.StringIO()
+    writer = csv.DictWriter(out, fieldnames=COLUMNS)
+    writer.writeheader()
+    for i, last_name in enumerate(['HOWARD', 'EGBUKA', 'THORNTON', 'LI']):
+        writer.writerow({
+            'Name': f"P-{i}", 'Team': 'NCAA-OHIO ST BUCKEYES', 'Color List': 'GRAPHITE',
+            'Art Type': 'STACKED BOX NEUTRAL', 'Class': 'Apparel: Tops: CREW', 'First Name': 'Will',
+            'Last Name': last_name, 'Jersey Number': str(i), 'Jersey Characters': '',
+            'Sport Specific': 'Football', 'Player Name': '', 'Description': '',
+        })
+    result = subprocess.run(
+        [sys.executable, 'generator.py', '-', '--workers', '2', '--web-scale', '0.1', '--no-render-cache',
+         '--profile', 'batch.pstats'],
+        cwd=workdir, input=out.getvalue(), capture_output=True, text=True, timeout=300)
+    assert result.returncode == 0, result.stderr
+    assert "Wrote profile: batch.pstats (this process and 2 pool worker(s))" in result.stdout
+    stats = pstats.Stats(str(workdir / 'batch.pstats')).stats
+    # Rendering only happens in the workers
+    calls = {func[2]: stat[1] for func, stat in stats.items() if func[0].endswith('generator.py')}
+    assert calls.get('build_image_from_assets') == 4
@@ -0,0 +1,86 @@
+# Starts render_service.py on a free localhost port and exercises /health and
+# /render over HTTP, including a batch of identical concurrent requests.
+
+import io
+import json
+import os
+import re
+import subprocess
+import sys
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+import pytest
+from PIL import Image
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FOLDER = 'NCAA-OHIO ST BUCKEYES-GRAPHITE-STACKED BOX NEUTRAL-CREW'
+SCALE = 0.25
+ROW = {'First Name': 'WILL', 'Last Name': 'HOWARD', 'Jersey Number': '18', 'Sport Specific': 'FOOTBALL'}
+TIMING_HEADERS = ('X-Queue-Ms', 'X-Render-Ms', 'X-Total-Ms')
+
+pytestmark = pytest.mark.skipif(not os.path.isdir(os.path.join(ROOT, 'bin', FOLDER)),
+                                reason="test asset missing from bin/")
+
+@pytest.fixture(scope="module")
+def service():
+    # A long batch window so the concurrent requests below land in one batch
+    process = subprocess.Popen(
+        [sys.executable, '-u', 'render_service.py', '--port', '0', '--workers', '2', '--scale', str(SCALE),
+         '--batch-window', '300', '--warm', FOLDER],
+        cwd=ROOT, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    try:
+        for line in process.stdout:
+            match = re.search(r"Serving previews on (http://[^/]+)/render", line)
+            if match:
+                break
+        else:
+            pytest.fail("render service exited before serving")
+        yield match.group(1)
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+
+def get(base, path):
+    try:
+        with urllib.request.urlopen(base + path, timeout=60) as response:
+            return response.status, response.headers, response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.headers, e.read()
+
+def test_health(service):
+    status, headers, body = get(service, '/health')
+    assert status == 200
+    assert headers['Content-Type'] == 'application/json'
+    assert json.loads(body) == {"status": "ok", "workers": 2}
+
+def test_render_returns_image_with_timing_headers(service):
+    status, headers, body = get(service, '/render?' + urlencode(dict(ROW, folder=FOLDER)))
+    assert status == 200
+    assert headers['Content-Type'] == 'image/png'
+    assert int(headers['Content-Length']) == len(body)
+    for name in TIMING_HEADERS:
+        assert float(headers[name]) >= 0
+    assert float(headers['X-Total-Ms']) >= float(headers['X-Render-Ms'])
+    assert headers['X-Batch-Size'] == '1'
+    assert re.fullmatch(r"queue;dur=[\d.]+, render;dur=[\d.]+, total;dur=[\d.]+", headers['Server-Timing'])
+    with Image.open(io.BytesIO(body)) as image, Image.open(os.path.join(ROOT, 'bin', FOLDER, 'blank.png')) as blank:
+        assert image.size == (round(blank.width * SCALE), round(blank.height * SCALE))
+
+def test_identical_requests_share_one_render(service):
+    query = '/render?' + urlencode(dict(ROW, folder=FOLDER, **{'Last Name': 'EGBUKA'}))
+    with ThreadPoolExecutor(3) as threads:
+        responses = list(threads.map(lambda _: get(service, query), range(3)))
+    assert [status for status, _, _ in responses] == [200, 200, 200]
+    assert {headers['X-Batch-Size'] for _, headers, _ in responses} == {'3'}
+    # One render: every response carries the same body and render time
+    assert len({body for _, _, body in responses}) == 1
+    assert len({headers['X-Render-Ms'] for _, headers, _ in responses}) == 1
+
+def test_render_rejects_bad_requests(service):
+    assert get(service, '/render?' + urlencode(dict(ROW, folder='..')))[0] == 400
+    assert get(service, '/render?' + urlencode(dict(ROW, folder='NO SUCH FOLDER')))[0] == 404
+    assert get(service, '/render?' + urlencode(dict(ROW, folder=FOLDER, scale='2')))[0] == 400
+    assert get(service, '/nowhere')[0] == 404
@@ -0,0 +1,38 @@
+# Rendering at small --web-scale values: narrow glyphs in long names must
+# still get a pixel of width, and scales that round a field's box away are
+# refused per row instead of raising.
+
+import os
+import sys
+
+import pytest
+from PIL import Image
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import generator
+from text_layout import layout_stretched
+
+ASSET = os.path.join(ROOT, 'bin', 'NCAA-OHIO ST BUCKEYES-GRAPHITE-STACKED BOX NEUTRAL-CREW')
+ROW = {'First Name': 'J.', 'Last Name': "O'NEIL-WILLIAMSONSMITHJONES", 'Jersey Number': '18',
+       'Sport Specific': "WOMEN'S VOLLEYBALL"}
+
+pytestmark = pytest.mark.skipif(not os.path.isdir(ASSET), reason="test asset missing from bin/")
+
+def test_stretched_glyphs_never_collapse():
+    layout = layout_stretched(os.path.join(ASSET, 'text.otf'), "O'NEIL.", 20, 4, 0.1, max_stretch=5)
+    assert min(layout.glyph_widths) >= 1
+
+@pytest.mark.parametrize("scale", [0.2, 0.15, 0.1])
+def test_small_scale_renders_long_names(scale):
+    image, err = generator.build_image_from_assets(ROW, ASSET, scale)
+    assert err is None
+    with Image.open(os.path.join(ASSET, 'blank.png')) as blank:
+        assert image.size == (round(blank.width * scale), round(blank.height * scale))
+
+@pytest.mark.parametrize("scale", [0.03, 0.001])
+def test_scale_that_collapses_a_box_is_an_error(scale):
+    image, err = generator.build_image_from_assets(ROW, ASSET, scale)
+    assert image is None
+    assert err.startswith(f"scale {scale} is too small")
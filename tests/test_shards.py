@@ -0,0 +1,72 @@
+# Sharded runs in a scratch directory: every shard reads the CSV from stdin,
+# then merge combines the partial manifests.
+
+import csv
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FOLDER_CLASSES = ('CREW', 'HOODIE', 'LS TEES', 'SS TEES')
+COLUMNS = ['Name', 'Team', 'Color List', 'Art Type', 'Class', 'First Name', 'Last Name', 'Jersey Number',
+           'Jersey Characters', 'Sport Specific', 'Player Name', 'Description']
+
+pytestmark = pytest.mark.skipif(
+    not all(os.path.isdir(os.path.join(ROOT, 'bin', f'NCAA-OHIO ST BUCKEYES-GRAPHITE-STACKED BOX NEUTRAL-{c}'))
+            for c in FOLDER_CLASSES),
+    reason="garment assets missing from bin/")
+
+def make_csv(last_names):
+    # Web images only: no Player Name, so no print files
+    out = io.StringIO()
+    writer = csv.DictWriter(out, fieldnames=COLUMNS)
+    writer.writeheader()
+    for i, last_name in enumerate(last_names):
+        writer.writerow({
+            'Name': f"P-{i}", 'Team': 'NCAA-OHIO ST BUCKEYES', 'Color List': 'GRAPHITE',
+            'Art Type': 'STACKED BOX NEUTRAL', 'Class': f"Apparel: Tops: {FOLDER_CLASSES[i % 4]}",
+            'First Name': 'Will', 'Last Name': last_name, 'Jersey Number': str(i),
+            'Jersey Characters': '', 'Sport Specific': 'Football', 'Player Name': '', 'Description': '',
+        })
+    return out.getvalue()
+
+@pytest.fixture
+def workdir(tmp_path):
+    for name in os.listdir(ROOT):
+        if name.endswith('.py'):
+            shutil.copy(os.path.join(ROOT, name), tmp_path)
+    os.symlink(os.path.join(ROOT, 'bin'), tmp_path / 'bin')
+    return tmp_path
+
+def generator(workdir, *args, stdin=None):
+    result = subprocess.run([sys.executable, 'generator.py', *args], cwd=workdir, input=stdin,
+                            capture_output=True, text=True, timeout=300)
+    assert result.returncode == 0, result.stderr
+    return result.stdout
+
+def test_stdin_shards_merge(workdir):
+    data = make_csv(['HOWARD', 'EGBUKA', 'THORNTON', 'LI', 'SMITH', 'JONES'])
+    for shard in ('1/2', '2/2'):
+        out = generator(workdir, '-', '--shard', shard, '--web-scale', '0.1', '--no-render-cache', stdin=data)
+        assert f"Shard {shard} manifest" in out
+    out = generator(workdir, 'merge')
+    assert "Merged 2 shards: 6 outputs, 0 problem(s)" in out
+    with open(workdir / 'output' / 'manifest.json', encoding='utf-8') as f:
+        outputs = json.load(f)["outputs"]
+    assert sorted(outputs) == [f"web-images/P-{i}-1.png" for i in range(6)]
+    for key in outputs:
+        assert (workdir / 'output' / key).is_file()
+
+def test_merge_rejects_shards_from_different_input(workdir):
+    names = ['HOWARD', 'EGBUKA', 'THORNTON', 'LI']
+    generator(workdir, '-', '--shard', '1/2', '--web-scale', '0.1', '--no-render-cache', stdin=make_csv(names))
+    generator(workdir, '-', '--shard', '2/2', '--web-scale', '0.1', '--no-render-cache',
+              stdin=make_csv(names[:-1] + ['JONES']))
+    out = generator(workdir, 'merge')
+    assert "come from different CSVs or render settings" in out
+    assert not (workdir / 'output' / 'manifest.json').exists()
@@ -0,0 +1,94 @@
+# fit_font_size must pick the same sizes as the search loops it replaced:
+# the binary search over per-character heights (names, sport) and the
+# one-point step-down from the box height over the whole-string bbox (numbers)
+
+import glob
+import hashlib
+import os
+import shutil
+import sys
+
+import pytest
+from PIL import ImageFont
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import text_layout
+
+BOX_HEIGHTS = list(range(1, 61)) + [75, 96, 120, 148, 190, 240, 310, 420, 560, 780]
+NAMES = ["HOWARD", "EGBUKA", "THORNTON", "LI", "OX", "Q", "J", "JR.", "O'NEIL", "MCDONALD-SMITH",
+         "FOOTBALL", "WOMEN'S VOLLEYBALL", "TRACK & FIELD"]
+NUMBERS = ["0", "1", "2", "4", "7", "10", "18", "00", "99", "#"]
+
+def unique_fonts(name):
+    # One path per distinct font file; garment variants share their fonts
+    fonts = {}
+    for path in sorted(glob.glob(os.path.join(ROOT, 'bin', '*', name))):
+        with open(path, 'rb') as f:
+            fonts.setdefault(hashlib.sha256(f.read()).hexdigest(), path)
+    return list(fonts.values())
+
+TEXT_FONTS = unique_fonts('text.otf')
+NUMBER_FONTS = unique_fonts('number.ttf')
+
+def legacy_binary_search(font_path, text, box_height):
+    low, high, best = 1, max(1, box_height), 1
+    while low <= high:
+        mid = (low + high) // 2
+        font = ImageFont.truetype(font_path, mid)
+        height = max((font.getbbox(c)[3] - font.getbbox(c)[1] for c in text), default=0)
+        if height <= box_height:
+            best, low = mid, mid + 1
+        else:
+            high = mid - 1
+    return best
+
+def legacy_step_down(font_path, text, box_height):
+    size = box_height
+    bbox = ImageFont.truetype(font_path, size).getbbox(text)
+    while bbox[3] - bbox[1] > box_height and size > 1:
+        size -= 1
+        bbox = ImageFont.truetype(font_path, size).getbbox(text)
+    return size
+
+@pytest.mark.skipif(not TEXT_FONTS, reason="no text.otf under bin/")
+@pytest.mark.parametrize("font_path", TEXT_FONTS)
+@pytest.mark.parametrize("text", NAMES)
+def test_name_fit_matches_binary_search(font_path, text):
+    mismatches = []
+    for box in BOX_HEIGHTS:
+        legacy = legacy_binary_search(font_path, text, box)
+        new = text_layout.fit_font_size(font_path, text, box)
+        if legacy != new:
+            mismatches.append((box, legacy, new))
+    assert not mismatches, f"(box, legacy, new): {mismatches}"
+
+@pytest.mark.skipif(not NUMBER_FONTS, reason="no number.ttf under bin/")
+@pytest.mark.parametrize("font_path", NUMBER_FONTS)
+@pytest.mark.parametrize("text", NUMBERS)
+def test_number_fit_matches_step_down(font_path, text):
+    mismatches = []
+    for box in BOX_HEIGHTS:
+        legacy = legacy_step_down(font_path, text, box)
+        new = text_layout.fit_font_size(font_path, text, box, per_char=False)
+        if legacy != new:
+            mismatches.append((box, legacy, new))
+    assert not mismatches, f"(box, legacy, new): {mismatches}"
+
+@pytest.mark.skipif(not (TEXT_FONTS and NUMBER_FONTS), reason="fonts missing under bin/")
+def test_replaced_font_is_reloaded(tmp_path):
+    # A long-lived process must measure the font now on disk, not a cached one
+    font_path = str(tmp_path / 'text.otf')
+    shutil.copy(TEXT_FONTS[0], font_path)
+    before = (text_layout.fit_font_size(font_path, "HOWARD", 200),
+              text_layout.glyph_table(font_path, 100).widths("HOWARD"))
+    stamp = os.stat(font_path)
+    shutil.copy(NUMBER_FONTS[0], font_path)
+    os.utime(font_path, ns=(stamp.st_atime_ns, stamp.st_mtime_ns + 10**9))
+    after = (text_layout.fit_font_size(font_path, "HOWARD", 200),
+             text_layout.glyph_table(font_path, 100).widths("HOWARD"))
+    fresh = ImageFont.truetype(NUMBER_FONTS[0], 100)
+    assert after[1] == [fresh.getbbox(c)[2] - fresh.getbbox(c)[0] for c in "HOWARD"]
+    assert after[0] == legacy_binary_search(NUMBER_FONTS[0], "HOWARD", 200)
+    assert before != after
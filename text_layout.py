@@ -0,0 +1,177 @@
+# Text measurement and layout shared by the renderers.
+#
+# Each (font, size) pair gets one GlyphTable that asks the font for a
+# character's bbox the first time that character is seen and never again.
+# Font fitting probes and the per-renderer layouts are then plain arithmetic
+# over the table rather than a getbbox call per character per probe.
+#
+# Every cache is keyed by the font file's path and its (mtime, size) stamp,
+# so a long-lived process (the preview service) picks up a replaced font
+# rather than drawing with the old one, the way blanks are re-read.
+
+import os
+from functools import lru_cache
+from itertools import accumulate
+from PIL import ImageFont
+
+# Font objects are cheap to keep but expensive to load (each load re-reads and
+# parses the font file), so every (path, size) pair is loaded at most once.
+FONT_CACHE_SIZE = 512
+# Size at which glyph heights are measured once before scaling to a target box
+FIT_REFERENCE_SIZE = 1000
+
+def font_stamp(font_path):
+    st = os.stat(font_path)
+    return st.st_mtime_ns, st.st_size
+
+@lru_cache(maxsize=FONT_CACHE_SIZE)
+def _load_font(font_path, stamp, size):
+    return ImageFont.truetype(font_path, size)
+
+def load_font(font_path, size):
+    return _load_font(font_path, font_stamp(font_path), size)
+
+class GlyphTable:
+    # Ink widths and heights of single characters (and bboxes of whole
+    # strings) at one font size, filled in as characters are first used.
+    def __init__(self, font_path, size, stamp):
+        self.font_path = font_path
+        self.size = size
+        self.stamp = stamp
+        self._chars = {}
+        self._strings = {}
+
+    @property
+    def font(self):
+        return _load_font(self.font_path, self.stamp, self.size)
+
+    def seed(self, metrics):
+        # Adopts {char: (width, height)} measured elsewhere (compiled templates)
+        for char, (width, height) in metrics.items():
+            self._chars.setdefault(char, (width, height))
+
+    def metrics(self, text):
+        # [(width, height)] for each character of text
+        chars = self._chars
+        for char in set(text).difference(chars):
+            left, top, right, bottom = self.font.getbbox(char)
+            chars[char] = (right - left, bottom - top)
+        return [chars[char] for char in text]
+
+    def widths(self, text):
+        return [width for width, _ in self.metrics(text)]
+
+    def bbox(self, text):
+        # Whole-string ink bbox, including kerning between characters
+        bbox = self._strings.get(text)
+        if bbox is None:
+            bbox = self._strings[text] = self.font.getbbox(text)
+        return bbox
+
+    def height(self, text, per_char=True):
+        # per_char: tallest single glyph (name/sport layout); else whole-string bbox
+        if per_char:
+            return max((height for _, height in self.metrics(text)), default=0)
+        bbox = self.bbox(text)
+        return bbox[3] - bbox[1]
+
+@lru_cache(maxsize=FONT_CACHE_SIZE)
+def _glyph_table(font_path, stamp, size):
+    return GlyphTable(font_path, size, stamp)
+
+def glyph_table(font_path, size):
+    return _glyph_table(font_path, font_stamp(font_path), size)
+
+def fit_font_size(font_path, text, box_height, per_char=True):
+    return _fit_font_size(font_path, font_stamp(font_path), text, box_height, per_char)
+
+@lru_cache(maxsize=4096)
+def _fit_font_size(font_path, stamp, text, box_height, per_char):
+    # Largest size in [1, box_height] whose text height fits the box (1 if none do).
+    # Glyph heights scale almost linearly with size, so the estimate from the
+    # reference measurement is normally exact or one step off.
+    max_size = max(1, box_height)
+    ref_height = _glyph_table(font_path, stamp, FIT_REFERENCE_SIZE).height(text, per_char)
+    if ref_height <= 0:
+        return max_size
+
+    def fits(size):
+        return _glyph_table(font_path, stamp, size).height(text, per_char) <= box_height
+
+    size = min(max_size, max(1, box_height * FIT_REFERENCE_SIZE // ref_height))
+    if fits(size):
+        while size < max_size and fits(size + 1):
+            size += 1
+    else:
+        while size > 1 and not fits(size):
+            size -= 1
+    return size
+
+def clear_caches():
+    _load_font.cache_clear()
+    _glyph_table.cache_clear()
+    _fit_font_size.cache_clear()
+
+class TextLayout:
+    # A fitted run of text. offsets are each glyph's x from the start of the
+    # run, char_widths the font's ink widths and glyph_widths the widths the
+    # glyphs are drawn at (different once stretched). width is the run width
+    # used for centring; it can be fractional for stretched runs.
+    def __init__(self, font_path, font_size, char_widths, glyph_widths, gaps, width, height):
+        self.font_path = font_path
+        self.font_size = font_size
+        self.char_widths = char_widths
+        self.glyph_widths = glyph_widths
+        self.offsets = [0] + list(accumulate(w + g for w, g in zip(glyph_widths, gaps)))
+        self.width = width
+        self.height = height
+
+    @property
+    def font(self):
+        return load_font(self.font_path, self.font_size)
+
+def layout_block(font_path, text, box_height):
+    # Single drawn string (jersey numbers), fitted on its whole-string bbox.
+    # bbox is the ink box relative to the draw origin.
+    font_size = fit_font_size(font_path, text, box_height, per_char=False)
+    bbox = glyph_table(font_path, font_size).bbox(text)
+    layout = TextLayout(font_path, font_size, [], [], [], bbox[2] - bbox[0], bbox[3] - bbox[1])
+    layout.bbox = bbox
+    return layout
+
+def layout_spaced(font_path, text, box_height, spacing_factor):
+    # Glyphs at natural width, each followed by spacing_factor of its own width.
+    # Height is the font's ascent + descent so every glyph fits a draw at y=0.
+    font_size = fit_font_size(font_path, text, box_height)
+    table = glyph_table(font_path, font_size)
+    widths = table.widths(text)
+    gaps = [int(w * spacing_factor) for w in widths[:-1]]
+    ascent, descent = table.font.getmetrics()
+    return TextLayout(font_path, font_size, widths, widths, gaps, sum(widths) + sum(gaps), ascent + descent)
+
+def layout_stretched(font_path, text, box_width, box_height, spacing_factor, max_stretch, justify=False):
+    # Glyphs stretched horizontally (up to max_stretch) so the spaced run
+    # fills box_width, and drawn at the full box height. Names scale their
+    # spacing with the glyphs; justified runs scale the whole-pixel minimum
+    # gaps instead and share out whatever width the stretch cap leaves unused.
+    font_size = fit_font_size(font_path, text, box_height)
+    widths = glyph_table(font_path, font_size).widths(text)
+    min_gaps = [int(w * spacing_factor) for w in widths[:-1]]
+    unstretched_width = sum(widths) + sum(min_gaps)
+    stretch = min(box_width / unstretched_width, max_stretch)
+    width = unstretched_width * stretch
+    # At least a pixel each: at small scales a narrow glyph (' or .) would
+    # otherwise stretch to nothing and could not be resampled
+    glyph_widths = [max(1, int(w * stretch)) for w in widths]
+
+    if not justify:
+        gaps = [int(w * spacing_factor * stretch) for w in widths[:-1]]
+    else:
+        gaps = [int(g * stretch) for g in min_gaps]
+        if width < box_width and gaps:
+            extra = box_width - width
+            per_gap = int(extra // len(gaps))
+            remainder = extra % len(gaps)
+            gaps = [g + per_gap + (1 if i < remainder else 0) for i, g in enumerate(gaps)]
+            width = box_width
+    return TextLayout(font_path, font_size, widths, glyph_widths, gaps, width, box_height)